@@ -0,0 +1,221 @@
+"""Times and peak memory of the data generation, network build and SEIR models on growing inputs.
+
+    python benchmark.py --output results.json
+    python benchmark.py --output new.json --compare results.json
+
+Inputs are built from the conference trace: the 2 days are repeated to reach --days days and grown to --scales
+times the population with iter_scaled_generating. A combination with more than --max-rows contacts is skipped, and
+DynamicSEIR, whose run time grows with both the number of moments and the population, is only run up to
+--max-dynamic-rows contacts.
+With --compare, the results are checked against a stored run and the command fails when a target is slower or
+uses more memory than the baseline by more than --tolerance."""
+from typing import Callable, Dict, List
+import argparse
+import datetime
+import gc
+import json
+import os
+import platform
+import sys
+import time
+import tracemalloc
+import numpy as np
+import pandas as pd
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, "data"))
+sys.path.insert(0, os.path.join(ROOT, "macro model"))
+
+import data_generating  # noqa: E402
+from Heterogeneous_Trajectory_Network import HeterogeneousTrajectoryNetwork  # noqa: E402
+from Homogenenous_Trajectory_Network import HomogeneousTrajectoryNetwork  # noqa: E402
+from Heterogeneous_SEIR import HeterogeneousSEIR  # noqa: E402
+from Dynamic_SEIR import DynamicSEIR  # noqa: E402
+
+# targets of the 2 raw days, only the population scale applies to them
+RAW_TARGETS = ("data_processing", "compute_avg_f", "replace_i_with_j")
+NETWORK_TARGETS = ("HeterogeneousTrajectoryNetwork.build_graph",
+                   "HomogeneousTrajectoryNetwork.build_graph", "HeterogeneousSEIR", "DynamicSEIR")
+TARGETS = RAW_TARGETS + NETWORK_TARGETS
+
+# parameters of the SEIR models, as in main.ipynb
+INFECT_RATE = 3e-4
+TIME_STEP = 24*60*60
+T_INCUBATION = 24*60*60
+T_RECOVERY = 2*24*60*60
+T_LOSS_IMMUNITY = 110*24*60*60
+
+
+def load_base_days(input_file: str):
+    return list(data_generating.iter_csv_days(input_file, gap=6*60*60))[:2]
+
+
+def scale_raw_day(df: pd.DataFrame, scale: int, no_ids: int, tags: np.ndarray) -> pd.DataFrame:
+    """scale relabelled copies of a raw day, person code + c*no_ids in copy c"""
+    coded_df, _ = data_generating.encode_ids(df, tags)
+    copies = np.repeat(np.arange(scale), len(df))
+    scaled_df = pd.concat([coded_df]*scale, ignore_index=True)
+    scaled_df["id_1"] = scaled_df["id_1"].to_numpy() + copies*no_ids
+    scaled_df["id_2"] = scaled_df["id_2"].to_numpy() + copies*no_ids
+    return scaled_df.sort_values("time", kind="stable").reset_index(drop=True)
+
+
+def make_days(df_1: pd.DataFrame, df_2: pd.DataFrame, no_days: int, scale: int) -> List[pd.DataFrame]:
+    """no_days processed days of scale times the population"""
+    days = []
+    for no_rows, chunks in data_generating.iter_scaled_generating(no_copies=scale, df_1=df_1, df_2=df_2, cross_rate=0.01,
+                                                                   no_iteration=(no_days+1)//2-1, seed=0, copies_per_chunk=max(1, scale)):
+        days.append(pd.concat(list(chunks), ignore_index=True))
+    return days[:no_days]
+
+
+def get_population(days: List[pd.DataFrame]):
+    """s_initial and i_initial with the first person of the first day infectious"""
+    ids = set(pd.unique(pd.concat([days[0]["id_1"], days[0]["id_2"]])).tolist())
+    i_initial = {min(ids)}
+    return ids - i_initial, i_initial
+
+
+def prepare(df_1: pd.DataFrame, df_2: pd.DataFrame, target: str, no_days: int, scale: int) -> Callable:
+    """A function running target on its input, the input is built beforehand"""
+    if target in RAW_TARGETS:
+        tags = np.sort(data_generating.get_unique_ids(df_1, df_2))
+        raw_1 = scale_raw_day(df_1, scale, len(tags), tags)
+        raw_2 = scale_raw_day(df_2, scale, len(tags), tags)
+        if target == "data_processing":
+            return len(raw_1), lambda: data_generating.data_processing(raw_1)
+        if target == "compute_avg_f":
+            return len(raw_1)+len(raw_2), lambda: data_generating.compute_avg_f(raw_1, raw_2)
+        return len(raw_1), lambda: data_generating.replace_i_with_j(raw_1, 0, 1)
+
+    days = make_days(df_1, df_2, no_days, scale)
+    no_rows = sum(len(df) for df in days)
+    s_initial, i_initial = get_population(days)
+    if target.endswith(".build_graph"):
+        # the graph of every day, the network itself is only built on the first day
+        network_class = HeterogeneousTrajectoryNetwork if target.startswith(
+            "Heterogeneous") else HomogeneousTrajectoryNetwork
+        network = network_class(days[:1], use_networkx=False)
+        return no_rows, lambda: [network.build_graph(df) for df in days]
+    if target == "HeterogeneousSEIR":
+        network = HeterogeneousTrajectoryNetwork(days, use_networkx=False)
+        # the sparse graphs are compiled once per network, as in repeated runs
+        HeterogeneousSEIR(trajectory_network=network, s_initial=s_initial, i_initial=i_initial, infect_rate=INFECT_RATE,
+                          t_incubation=T_INCUBATION, t_recovery=T_RECOVERY, time_step=TIME_STEP, seed=0)
+        return no_rows, lambda: HeterogeneousSEIR(trajectory_network=network, s_initial=s_initial, i_initial=i_initial, infect_rate=INFECT_RATE,
+                                                  t_incubation=T_INCUBATION, t_recovery=T_RECOVERY, time_step=TIME_STEP, seed=0)
+
+    # contacts in order of their end moment, as data_processing gives them to DynamicSEIR in main.ipynb
+    df = pd.concat(days, ignore_index=True).sort_values(
+        "end_moment", kind="stable").reset_index(drop=True)
+    return no_rows, lambda: DynamicSEIR(df=df, s_initial=s_initial, i_initial=i_initial, infect_rate=INFECT_RATE,
+                                        t_incubation=T_INCUBATION, t_recovery=T_RECOVERY, t_loss_immunity=T_LOSS_IMMUNITY)
+
+
+def measure(run: Callable, repeat: int) -> Dict[str, float]:
+    """Best wall-clock time of repeat runs, and peak traced memory of one more run"""
+    seconds = []
+    for _ in range(repeat):
+        gc.collect()
+        start = time.perf_counter()
+        run()
+        seconds.append(time.perf_counter()-start)
+
+    gc.collect()
+    tracemalloc.start()
+    run()
+    peak_bytes = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return {"seconds": min(seconds), "peak_bytes": peak_bytes}
+
+
+def run_benchmarks(input_file: str, targets: List[str], days: List[int], scales: List[int], repeat: int, max_rows: int, max_dynamic_rows: int) -> dict:
+    df_1, df_2 = load_base_days(input_file)
+    base_rows = (len(data_generating.data_processing(df_1)) +
+                 len(data_generating.data_processing(df_2)))/2
+
+    results = []
+    for target in targets:
+        for scale in scales:
+            # the raw targets only work on the 2 days
+            for no_days in ([2] if target in RAW_TARGETS else days):
+                result = {"target": target, "days": no_days, "scale": scale}
+                limit = max_dynamic_rows if target == "DynamicSEIR" else max_rows
+                if base_rows*no_days*scale > limit:
+                    result["skipped"] = True
+                    results.append(result)
+                    continue
+
+                no_rows, run = prepare(df_1, df_2, target, no_days, scale)
+                result.update(rows=no_rows, **measure(run, repeat))
+                print("{target:44} days={days:<4} scale={scale:<4} {seconds:10.4f}s {peak_bytes:>14,}B".format(
+                    **result), flush=True)
+                results.append(result)
+
+    return {"meta": {"date": datetime.datetime.now().isoformat(timespec="seconds"), "python": platform.python_version(),
+                     "numpy": np.__version__, "pandas": pd.__version__, "platform": platform.platform(),
+                     "repeat": repeat, "max_rows": max_rows, "max_dynamic_rows": max_dynamic_rows},
+            "results": results}
+
+
+def compare(results: dict, baseline: dict, tolerance: float) -> List[str]:
+    """Targets slower or using more memory than in baseline by more than tolerance"""
+    key = ("target", "days", "scale")
+    baseline_results = {tuple(result[name] for name in key): result for result in baseline["results"]
+                        if not result.get("skipped")}
+
+    regressions = []
+    for result in results["results"]:
+        reference = baseline_results.get(tuple(result[name] for name in key))
+        if reference is None or result.get("skipped"):
+            continue
+        for metric in ("seconds", "peak_bytes"):
+            ratio = result[metric]/reference[metric] if reference[metric] > 0 else 1
+            result[metric + "_ratio"] = ratio
+            if ratio > 1+tolerance:
+                regressions.append("{} days={} scale={}: {} {:.4g} -> {:.4g} (x{:.2f})".format(
+                    result["target"], result["days"], result["scale"], metric, reference[metric], result[metric], ratio))
+    return regressions
+
+
+def parse_list(text: str) -> List[int]:
+    return [int(value) for value in text.split(",")]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Benchmark data generation, network build and SEIR models")
+    parser.add_argument("--input", default=os.path.join(ROOT, "data", "conference_attendance_data.csv"))
+    parser.add_argument("--output", default="benchmark_results.json")
+    parser.add_argument("--targets", default=",".join(TARGETS))
+    parser.add_argument("--days", type=parse_list, default=[2, 20, 100])
+    parser.add_argument("--scales", type=parse_list, default=[1, 10, 100])
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--max-rows", type=int, default=5*10**7)
+    parser.add_argument("--max-dynamic-rows", type=int, default=3*10**6,
+                        help="largest input of DynamicSEIR, about a minute per run")
+    parser.add_argument("--compare", default=None,
+                        help="baseline json of a previous run")
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    args = parser.parse_args()
+
+    targets = args.targets.split(",")
+    unknown = set(targets) - set(TARGETS)
+    if unknown:
+        parser.error("unknown targets: {}".format(", ".join(sorted(unknown))))
+
+    results = run_benchmarks(args.input, targets, args.days,
+                             args.scales, args.repeat, args.max_rows, args.max_dynamic_rows)
+
+    regressions = []
+    if args.compare is not None:
+        with open(args.compare) as file:
+            regressions = compare(results, json.load(file), args.tolerance)
+        results["meta"]["baseline"] = args.compare
+
+    with open(args.output, "w") as file:
+        json.dump(results, file, indent=2)
+
+    for regression in regressions:
+        print("REGRESSION", regression)
+    sys.exit(1 if regressions else 0)
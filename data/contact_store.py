@@ -0,0 +1,149 @@
+from typing import Dict, Iterable, Iterator
+import json
+import os
+import shutil
+import numpy
+import pandas as pd
+
+MANIFEST_FILE = "manifest.json"
+STORE_VERSION = 1
+
+
+class ContactStore():
+    """Synthetic contact data on disk, one directory of .npy columns per strategy and day plus a manifest.
+
+    directory/manifest.json lists the strategies, their number of days and columns, and
+    directory/<strategy>/<day>/<column>.npy holds each column of a day. A day is read alone, memory-mapped,
+    without loading the other days or strategies. When the days of a strategy hold dense codes of the ids,
+    directory/<strategy>/tags.npy holds the original ids, tags[code] being the id of code."""
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        self.manifest = {"version": STORE_VERSION, "strategies": {}}
+        manifest_path = os.path.join(self.directory, MANIFEST_FILE)
+        if os.path.exists(manifest_path):
+            with open(manifest_path) as file:
+                self.manifest = json.load(file)
+
+    def get_strategies(self):
+        return list(self.manifest["strategies"])
+
+    def get_no_days(self, strategy: str) -> int:
+        return self.manifest["strategies"][strategy]["no_days"]
+
+    def get_tags(self, strategy: str) -> numpy.ndarray:
+        """The original ids of the codes in the days of strategy, None if the days hold the original ids"""
+        if not self.manifest["strategies"][strategy].get("coded", False):
+            return None
+        return numpy.load(os.path.join(self.directory, strategy, "tags.npy"))
+
+    def write_days(self, strategy: str, days: Iterable[pd.DataFrame], tags: numpy.ndarray = None):
+        """Write the days of a strategy one at a time as they come, replacing the strategy if it exists.
+
+        When tags is given, id_1 and id_2 of the days are codes of tags and tags is stored with them"""
+        strategy_path = self.make_strategy_directory(strategy, tags)
+
+        no_days = 0
+        columns = []
+        for day, df in enumerate(days):
+            day_path = os.path.join(strategy_path, str(day))
+            os.makedirs(day_path)
+            columns = list(df.columns)
+            for column in columns:
+                numpy.save(os.path.join(day_path, column + ".npy"),
+                           numpy.ascontiguousarray(df[column].to_numpy()))
+            no_days += 1
+
+        self.manifest["strategies"][strategy] = {
+            "no_days": no_days, "columns": columns, "coded": tags is not None}
+        self.write_manifest()
+
+    def write_chunked_days(self, strategy: str, days: Iterable, tags: numpy.ndarray = None):
+        """Write the days of a strategy given as (no_rows, iterable of df chunks), a chunk at a time.
+
+        The columns of a day are preallocated .npy files filled by the chunks, so only one chunk is in memory"""
+        strategy_path = self.make_strategy_directory(strategy, tags)
+
+        no_days = 0
+        columns = []
+        for day, (no_rows, chunks) in enumerate(days):
+            day_path = os.path.join(strategy_path, str(day))
+            os.makedirs(day_path)
+            arrays = None
+            row = 0
+            for df in chunks:
+                if arrays is None:
+                    columns = list(df.columns)
+                    arrays = {column: numpy.lib.format.open_memmap(os.path.join(day_path, column + ".npy"), mode="w+",
+                                                                   dtype=df[column].dtype, shape=(no_rows,)) for column in columns}
+                for column in columns:
+                    arrays[column][row:row+len(df)] = df[column].to_numpy()
+                row += len(df)
+            if row != no_rows:
+                raise ValueError("day {} of {} has {} rows instead of {}".format(
+                    day, strategy, row, no_rows))
+            for array in (arrays or {}).values():
+                array.flush()
+            no_days += 1
+
+        self.manifest["strategies"][strategy] = {
+            "no_days": no_days, "columns": columns, "coded": tags is not None}
+        self.write_manifest()
+
+    def make_strategy_directory(self, strategy: str, tags: numpy.ndarray = None) -> str:
+        """An empty directory for the days of strategy, with tags.npy when tags is given"""
+        strategy_path = os.path.join(self.directory, strategy)
+        shutil.rmtree(strategy_path, ignore_errors=True)
+        os.makedirs(strategy_path)
+        if tags is not None:
+            numpy.save(os.path.join(strategy_path, "tags.npy"), numpy.asarray(tags))
+        return strategy_path
+
+    def write_manifest(self):
+        # the manifest is replaced at once, so readers never see a partial one
+        temporary_path = os.path.join(self.directory, MANIFEST_FILE + ".tmp")
+        with open(temporary_path, "w") as file:
+            json.dump(self.manifest, file, indent=2)
+        os.replace(temporary_path, os.path.join(self.directory, MANIFEST_FILE))
+
+    def read_columns(self, strategy: str, day: int, mmap: bool = True) -> Dict[str, numpy.ndarray]:
+        """The columns of a day, memory-mapped read-only when mmap"""
+        if day < 0 or day >= self.get_no_days(strategy):
+            raise IndexError(
+                "day {} of {} is out of range".format(day, strategy))
+        day_path = os.path.join(self.directory, strategy, str(day))
+        return {column: numpy.load(os.path.join(day_path, column + ".npy"), mmap_mode="r" if mmap else None)
+                for column in self.manifest["strategies"][strategy]["columns"]}
+
+    def read_day(self, strategy: str, day: int) -> pd.DataFrame:
+        """The day as a df over the memory-mapped columns, which are not copied"""
+        return pd.DataFrame(self.read_columns(strategy, day), copy=False)
+
+    def iter_days(self, strategy: str) -> Iterator[pd.DataFrame]:
+        for day in range(self.get_no_days(strategy)):
+            yield self.read_day(strategy, day)
+
+    def get_days(self, strategy: str) -> "StoredDays":
+        """The days of a strategy as a lazy sequence, each day is read when indexed"""
+        return StoredDays(self, strategy)
+
+
+class StoredDays():
+    """Sequence of the days of a strategy in a ContactStore, read on access"""
+
+    def __init__(self, store: ContactStore, strategy: str):
+        self.store = store
+        self.strategy = strategy
+        # original ids of the codes in the days, None if the days hold the original ids
+        self.tags = store.get_tags(strategy)
+
+    def __len__(self):
+        return self.store.get_no_days(self.strategy)
+
+    def __getitem__(self, day: int) -> pd.DataFrame:
+        if day < 0:
+            day += len(self)
+        return self.store.read_day(self.strategy, day)
+
+    def __iter__(self):
+        return self.store.iter_days(self.strategy)
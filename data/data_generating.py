@@ -1,37 +1,168 @@
-from typing import List
+from typing import Dict, Iterator, List, Set
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from scipy import sparse
+from contact_store import ContactStore
 import pandas as pd
 import random
 import math
 import numpy
-import pickle
+import os
 
-
-def compute_f(id, df_1: pd.DataFrame, df_2: pd.DataFrame) -> float:
-    # df must have 3 columns: id_1, i_d2, contact_duration
-
-    # day 1
-    contacts_1_of_id = df_1[(df_1["id_1"] == id) | (df_1["id_2"] == id)]
-    V_1 = set(contacts_1_of_id['id_1']).union(set(contacts_1_of_id['id_2']))
-    # all individuals that id meets excluding itself
-    V_1.discard(id)
-    if len(V_1) == 0:
-        return 0
-
-    # day 2
-    contacts_2_of_id = df_2[(df_2["id_1"] == id) | (df_2["id_2"] == id)]
-    V_2 = set(contacts_2_of_id['id_1']).union(set(contacts_2_of_id['id_2']))
-    # all individuals that id meets excluding itself
-    V_2.discard(id)
-
-    f = len(V_1.intersection(V_2))/len(V_1)
-    return f
+# strategies of parallel_generating, their index is part of the seed of each iteration
+PARALLEL_STRATEGIES = ("repetitive", "random_shuffle")
 
 
 def compute_avg_f(df_1: pd.DataFrame, df_2: pd.DataFrame) -> float:
     unique_ids = get_unique_ids(df_1=df_1, df_2=df_2)
 
-    f_scores = [compute_f(id, df_1=df_1, df_2=df_2) for id in unique_ids]
-    return sum(f_scores)/len(f_scores)
+    f_scores = compute_f_scores(unique_ids, get_neighbor_index(df_1, unique_ids),
+                                get_neighbor_index(df_2, unique_ids))
+    # summed in the order of unique_ids
+    return sum(f_scores.tolist())/len(f_scores)
+
+
+def get_neighbor_index(df: pd.DataFrame, unique_ids: numpy.ndarray) -> sparse.csr_array:
+    """Boolean adjacency of the individuals who meet in df, row/column i is unique_ids[i] (self contacts excluded)"""
+    order = numpy.argsort(unique_ids, kind='stable')
+    sorted_ids = unique_ids[order]
+    index_1 = order[numpy.searchsorted(sorted_ids, df["id_1"].to_numpy())]
+    index_2 = order[numpy.searchsorted(sorted_ids, df["id_2"].to_numpy())]
+    others = index_1 != index_2
+    index_1, index_2 = index_1[others], index_2[others]
+
+    adjacency = sparse.csr_array((numpy.ones(2*len(index_1), dtype=bool), (numpy.concatenate([index_1, index_2]), numpy.concatenate([index_2, index_1]))),
+                                 shape=(len(unique_ids), len(unique_ids)))
+    # repeated contacts are summed by csr_array, a neighbor counts once
+    adjacency.sum_duplicates()
+    adjacency.data[:] = True
+    return adjacency
+
+
+def compute_f_scores(unique_ids: numpy.ndarray, neighbors_1: sparse.csr_array, neighbors_2: sparse.csr_array) -> numpy.ndarray:
+    """f of each of unique_ids given their neighbor index in day 1 and day 2.
+
+    f of an id is the share of the individuals it meets in day 1 (excluding itself) that it meets again in day 2,
+    0 when it meets nobody in day 1"""
+    no_neighbors_1 = numpy.diff(neighbors_1.indptr)
+    no_common_neighbors = numpy.diff(neighbors_1.multiply(neighbors_2).tocsr().indptr)
+
+    f_scores = numpy.zeros(len(unique_ids))
+    met = no_neighbors_1 > 0
+    f_scores[met] = no_common_neighbors[met]/no_neighbors_1[met]
+    return f_scores
+
+
+def get_neighbor_sets(df: pd.DataFrame):
+    """Individuals that each id meets excluding itself, and the ids with a contact with themselves"""
+    neighbors = defaultdict(set)
+    self_contacts = set()
+    for id_1, id_2 in df[["id_1", "id_2"]].drop_duplicates().itertuples(index=False):
+        if id_1 == id_2:
+            self_contacts.add(id_1)
+        else:
+            neighbors[id_1].add(id_2)
+            neighbors[id_2].add(id_1)
+    return neighbors, self_contacts
+
+
+def replace_neighbor_sets(neighbors: Dict[int, Set[int]], self_contacts: Set[int], tag_i, tag_j) -> Dict[int, Set[int]]:
+    """The neighbor sets changed by replace_i_with_j, the others stay the same"""
+    neighbors_i = neighbors.get(tag_i, set())
+    # contacts between i and j are kept, and a contact of i with itself becomes a contact with j
+    met_j = tag_j in neighbors_i or tag_i in self_contacts
+
+    changed = {tag_i: {tag_j} if met_j else set(),
+               tag_j: neighbors.get(tag_j, set()) | (neighbors_i - {tag_j}) | ({tag_i} if tag_i in self_contacts else set())}
+    # i is replaced with j in the contacts of the other neighbors of i
+    for id in neighbors_i - {tag_j}:
+        changed[id] = (neighbors[id] - {tag_i}) | {tag_j}
+    return changed
+
+
+def compute_replaced_avg_f(f_scores: Dict[int, float], sum_f_scores: float, days, tag_i, tag_j) -> float:
+    """compute_avg_f after replace_i_with_j, from the f of the ids whose neighbors change.
+
+    f_scores are the f of all unique ids of the original days, days the (neighbors, self_contacts) of each day"""
+    (neighbors_1, self_contacts_1), (neighbors_2, self_contacts_2) = days
+    changed_1 = replace_neighbor_sets(neighbors_1, self_contacts_1, tag_i, tag_j)
+    changed_2 = replace_neighbor_sets(neighbors_2, self_contacts_2, tag_i, tag_j)
+
+    no_ids = len(f_scores)
+    for id in set(changed_1).union(changed_2):
+        V_1 = changed_1.get(id, neighbors_1.get(id, set()))
+        V_2 = changed_2.get(id, neighbors_2.get(id, set()))
+        sum_f_scores -= f_scores.get(id, 0)
+
+        # i only stays in the data through its contacts with j
+        if id == tag_i and len(V_1) == 0 and len(V_2) == 0:
+            no_ids -= 1
+            continue
+        sum_f_scores += 0 if len(V_1) == 0 else len(V_1.intersection(V_2))/len(V_1)
+    return sum_f_scores/no_ids
+
+
+def iter_csv_days(input_file: str, day_length: int = 24*60*60, gap: int = None, chunksize: int = 10**6, no_days: int = None) -> Iterator[pd.DataFrame]:
+    """The days of a contact trace CSV (time, id_1, id_2, contact_duration, sorted by time) one at a time.
+
+    The CSV is read in chunks with int32 columns. Without gap, day k holds the times in [k*day_length, (k+1)*day_length),
+    every day from day 0 to the day of the last contact is yielded, days without contacts as empty frames, followed by
+    empty days until no_days when it is given.
+    With gap, a new day starts after a pause longer than gap between 2 consecutive times, and day k >= 1 is shifted
+    so that it starts at k*day_length"""
+    dtypes = {"time": numpy.int32, "id_1": numpy.int32,
+              "id_2": numpy.int32, "contact_duration": numpy.int32}
+    # frame of the days without any contact
+    empty_df = pd.DataFrame({column: numpy.array([], dtype=dtype) for column, dtype in dtypes.items()})
+
+    day = 0
+    # next day to yield
+    next_day = 0
+    # rows of the current day from the previous chunks
+    pending = []
+    last_time = None
+    for chunk in pd.read_csv(input_file, dtype=dtypes, chunksize=chunksize):
+        empty_df = chunk.iloc[0:0]
+        if len(chunk) == 0:
+            continue
+        times = chunk["time"].to_numpy()
+        if gap is None:
+            day_of_row = times // day_length
+        else:
+            previous_times = numpy.concatenate(
+                [[times[0] if last_time is None else last_time], times[:-1]])
+            day_of_row = day + numpy.cumsum(times - previous_times > gap)
+        last_time = times[-1]
+
+        # days which end in this chunk
+        bounds = numpy.flatnonzero(numpy.diff(day_of_row)) + 1
+        for start, end in zip(numpy.concatenate([[0], bounds]), numpy.concatenate([bounds, [len(chunk)]])):
+            if len(pending) > 0 and day_of_row[start] != day:
+                yield normalise_day(pd.concat(pending, ignore_index=True), day, day_length, gap)
+                pending = []
+                next_day = day + 1
+            if len(pending) == 0:
+                # days without any contact, including the days before the first contact
+                for empty_day in range(next_day, day_of_row[start]):
+                    yield normalise_day(empty_df, empty_day, day_length, gap)
+            day = day_of_row[start]
+            pending.append(chunk.iloc[start:end])
+
+    if len(pending) > 0:
+        yield normalise_day(pd.concat(pending, ignore_index=True), day, day_length, gap)
+        next_day = day + 1
+    for empty_day in range(next_day, no_days or 0):
+        yield normalise_day(empty_df, empty_day, day_length, gap)
+
+
+def normalise_day(df: pd.DataFrame, day: int, day_length: int, gap: int = None) -> pd.DataFrame:
+    """A day of iter_csv_days, shifted to start at day*day_length when days are split by gaps"""
+    df = df.reset_index(drop=True)
+    # empty days have nothing to shift
+    if gap is not None and day > 0 and len(df) > 0:
+        df["time"] = (df["time"] + day*day_length -
+                      df["time"].iloc[0]).astype(numpy.int32)
+    return df
 
 
 def get_unique_ids(df_1: pd.DataFrame, df_2: pd.DataFrame) -> numpy.ndarray:
@@ -51,21 +182,63 @@ def update_time(df: pd.DataFrame, iter: int):
 
 def replace_i_with_j(df: pd.DataFrame, tag_i, tag_j) -> pd.DataFrame:
     df_copy = df.copy()
-    df_copy.loc[df_copy['id_2'] != tag_j,
-                'id_1'] = df_copy.loc[df_copy['id_2'] != tag_j, 'id_1'].replace(tag_i, tag_j)
-    df_copy.loc[df_copy['id_1'] != tag_j,
-                'id_2'] = df_copy.loc[df_copy['id_1'] != tag_j, 'id_2'].replace(tag_i, tag_j)
+    id_1 = df_copy['id_1'].to_numpy()
+    id_2 = df_copy['id_2'].to_numpy()
+    # contacts between i and j are kept
+    id_1 = numpy.where((id_1 == tag_i) & (id_2 != tag_j), tag_j, id_1)
+    id_2 = numpy.where((id_2 == tag_i) & (id_1 != tag_j), tag_j, id_2)
+    df_copy['id_1'] = id_1.astype(df['id_1'].dtype)
+    df_copy['id_2'] = id_2.astype(df['id_2'].dtype)
 
     return df_copy
 
 
 def shuffle_i_and_j(df: pd.DataFrame, tag_i, tag_j) -> pd.DataFrame:
     df_copy = df.copy()
-    df_copy['id_1'] = df_copy['id_1'].replace(
-        {tag_i: tag_j, tag_j: tag_i})
-    df_copy['id_2'] = df_copy['id_2'].replace(
-        {tag_i: tag_j, tag_j: tag_i})
+    for column in ('id_1', 'id_2'):
+        ids = df_copy[column].to_numpy()
+        df_copy[column] = numpy.where(ids == tag_i, tag_j, numpy.where(
+            ids == tag_j, tag_i, ids)).astype(ids.dtype)
+
+    return df_copy
+
+
+def encode_ids(df: pd.DataFrame, tags: numpy.ndarray = None):
+    """df with id_1 and id_2 replaced by dense int32 codes, and tags such that tags[code] is the original id"""
+    if tags is None:
+        tags = numpy.unique(numpy.concatenate(
+            [df['id_1'].to_numpy(), df['id_2'].to_numpy()]))
+    df_copy = df.copy()
+    df_copy['id_1'] = numpy.searchsorted(tags, df['id_1'].to_numpy()).astype(numpy.int32)
+    df_copy['id_2'] = numpy.searchsorted(tags, df['id_2'].to_numpy()).astype(numpy.int32)
+    return df_copy, tags
+
 
+def decode_ids(df: pd.DataFrame, tags: numpy.ndarray) -> pd.DataFrame:
+    df_copy = df.copy()
+    df_copy['id_1'] = tags[df['id_1'].to_numpy()]
+    df_copy['id_2'] = tags[df['id_2'].to_numpy()]
+    return df_copy
+
+
+def swap_permutation(permutation: numpy.ndarray, code_i, code_j) -> numpy.ndarray:
+    """permutation followed by the swap of code_i and code_j, a chain of swaps composes in O(ids)"""
+    swap = numpy.arange(len(permutation), dtype=permutation.dtype)
+    swap[code_i], swap[code_j] = code_j, code_i
+    return swap[permutation]
+
+
+def permute_processed_ids(df: pd.DataFrame, id_map: numpy.ndarray) -> pd.DataFrame:
+    """df processed by data_processing with each code replaced by id_map[code], in one gather per column.
+
+    id_map is a permutation composed with tags (tags[permutation]), so pairs are mapped to pairs and the continuous
+    contacts merged by data_processing stay the same, only id_1 < id_2 has to be restored"""
+    id_1 = id_map[df["id_1"].to_numpy()]
+    id_2 = id_map[df["id_2"].to_numpy()]
+
+    df_copy = df.copy()
+    df_copy["id_1"] = numpy.minimum(id_1, id_2)
+    df_copy["id_2"] = numpy.maximum(id_1, id_2)
     return df_copy
 
 
@@ -100,45 +273,163 @@ def data_processing(df: pd.DataFrame):
     return df_copy
 
 
+def update_processed_time(df: pd.DataFrame, iter: int) -> pd.DataFrame:
+    """update_time for a df already processed by data_processing"""
+    current_day_in_second = 2*24*60*60*iter
+    df_copy = df.copy()
+    df_copy["end_moment"] = df_copy["end_moment"]+current_day_in_second
+    df_copy["start_moment"] = df_copy["start_moment"]+current_day_in_second
+    return df_copy
+
+
+def iter_repetitive_generating(no_iteration: int, df_1: pd.DataFrame, df_2: pd.DataFrame) -> Iterator[pd.DataFrame]:
+    """The days of repetitive_generating one at a time, the 2 days are only processed once"""
+    return iter_generating(strategy="repetitive", no_iteration=no_iteration, df_1=df_1, df_2=df_2)
+
+
 def repetitive_generating(no_iteration: int, df_1: pd.DataFrame, df_2: pd.DataFrame) -> List[pd.DataFrame]:
-    dfs = [df_1.copy(), df_2.copy()]
-    iter = 1
-    while iter <= no_iteration:
-        df_1_copy = df_1.copy()
-        df_2_copy = df_2.copy()
+    return list(iter_repetitive_generating(no_iteration=no_iteration, df_1=df_1, df_2=df_2))
 
-        df_1_copy = update_time(df_1_copy, iter)
-        df_2_copy = update_time(df_2_copy, iter)
 
-        dfs.append(df_1_copy)
-        dfs.append(df_2_copy)
+def iter_random_shuffle_generating(no_iteration: int, df_1: pd.DataFrame, df_2: pd.DataFrame, seed: int = None) -> Iterator[pd.DataFrame]:
+    """The days of random_shuffle_generating one at a time, the 2 days are only processed once.
 
-        iter += 1
+    The days are the ones of parallel_generating with the same seed, seed is drawn from random when None"""
+    return iter_generating(strategy="random_shuffle", no_iteration=no_iteration, df_1=df_1, df_2=df_2, seed=seed)
 
-    return [data_processing(df=df) for df in dfs]
 
+def random_shuffle_generating(no_iteration: int, df_1: pd.DataFrame, df_2: pd.DataFrame, seed: int = None) -> List[pd.DataFrame]:
+    return list(iter_random_shuffle_generating(no_iteration=no_iteration, df_1=df_1, df_2=df_2, seed=seed))
 
-def random_shuffle_generating(no_iteration: int, df_1: pd.DataFrame, df_2: pd.DataFrame) -> List[pd.DataFrame]:
-    dfs = [df_1.copy(), df_2.copy()]
 
+def iter_scaled_generating(no_copies: int, df_1: pd.DataFrame, df_2: pd.DataFrame, cross_rate: float = 0.01, no_iteration: int = 0, seed: int = 0, copies_per_chunk: int = 100) -> Iterator:
+    """A population no_copies times larger, made of relabelled copies of the 2 days, for load tests.
+
+    Person code of copy c is code + c*no_ids. Each contact of a copy goes with probability cross_rate to the same
+    person in another random copy instead, so the contact durations keep their empirical distribution. Like
+    repetitive_generating, the 2 days are repeated no_iteration times.
+
+    Yields (no_rows, chunks) for each day, chunks being a generator of processed dfs of copies_per_chunk copies
+    (see ContactStore.write_chunked_days). Each chunk is sorted by time, a whole day is not."""
+    processed_days = [data_processing(df=df) for df in (df_1, df_2)]
     unique_ids = get_unique_ids(df_1=df_1, df_2=df_2)
-    iter = 1
-    while iter <= no_iteration:
+    tags = numpy.sort(unique_ids)
+    coded_days = [encode_ids(df, tags)[0] for df in processed_days]
+
+    for iter in range(no_iteration+1):
+        for day, coded_df in enumerate(coded_days):
+            chunks = iter_scaled_chunks(coded_df, len(tags), no_copies, cross_rate, seed=(
+                seed, 2*iter+day), copies_per_chunk=copies_per_chunk)
+            yield no_copies*len(coded_df), (update_processed_time(chunk, iter) for chunk in chunks)
+
+
+def iter_scaled_chunks(coded_df: pd.DataFrame, no_ids: int, no_copies: int, cross_rate: float, seed, copies_per_chunk: int) -> Iterator[pd.DataFrame]:
+    id_1 = coded_df["id_1"].to_numpy().astype(numpy.int64)
+    id_2 = coded_df["id_2"].to_numpy().astype(numpy.int64)
+    dtype = numpy.int32 if no_copies*no_ids < 2**31 else numpy.int64
+
+    for first_copy in range(0, no_copies, copies_per_chunk):
+        copies = numpy.arange(first_copy, min(
+            first_copy+copies_per_chunk, no_copies))
+        rng = numpy.random.default_rng([*seed, first_copy])
+
+        # dim: copies x contacts
+        copy_1 = numpy.repeat(copies[:, None], len(coded_df), axis=1)
+        copy_2 = copy_1.copy()
+        if no_copies > 1:
+            cross = rng.random(copy_2.shape) < cross_rate
+            # another copy than the one of id_1
+            copy_2[cross] = (copy_2[cross] + rng.integers(1,
+                             no_copies, cross.sum())) % no_copies
+
+        new_id_1 = (id_1[None, :] + copy_1*no_ids).ravel()
+        new_id_2 = (id_2[None, :] + copy_2*no_ids).ravel()
+        chunk = pd.DataFrame({"id_1": numpy.minimum(new_id_1, new_id_2).astype(dtype),
+                              "id_2": numpy.maximum(new_id_1, new_id_2).astype(dtype)})
+        for column in coded_df.columns:
+            if column not in ("id_1", "id_2"):
+                chunk[column] = numpy.tile(
+                    coded_df[column].to_numpy(), len(copies))
+        chunk = chunk[list(coded_df.columns)]
+        yield chunk.iloc[numpy.argsort(chunk["end_moment"].to_numpy(), kind='stable')].reset_index(drop=True)
+
+
+def get_iteration_seed(seed: int, strategy: str, iter: int) -> int:
+    """Seed of an iteration derived from the master seed, it does not depend on which worker runs the iteration"""
+    return int(numpy.random.SeedSequence([seed, PARALLEL_STRATEGIES.index(strategy), iter]).generate_state(1)[0])
+
+
+# processed base days of a generation worker, see init_generation_worker
+worker_days = {}
+
+
+def init_generation_worker(coded_df_1: pd.DataFrame, coded_df_2: pd.DataFrame, tags: numpy.ndarray, unique_ids: numpy.ndarray):
+    worker_days.update(coded_df_1=coded_df_1, coded_df_2=coded_df_2,
+                       tags=tags, unique_ids=unique_ids)
+
+
+def generate_iteration(task) -> List[pd.DataFrame]:
+    """The 2 days of an iteration of a strategy, from the base days of the worker"""
+    strategy, iter, seed = task
+    return generate_iteration_days(strategy, iter, seed, (worker_days["coded_df_1"], worker_days["coded_df_2"]),
+                                   worker_days["tags"], worker_days["unique_ids"])
+
+
+def generate_iteration_days(strategy: str, iter: int, seed: int, coded_dfs, tags: numpy.ndarray, unique_ids: numpy.ndarray) -> List[pd.DataFrame]:
+    """The 2 days of an iteration of a strategy from the processed days coded by tags, seed is the one of the
+    iteration (see get_iteration_seed). Both the sequential generators and the pool workers derive the days here"""
+    id_map = tags
+    if strategy == "random_shuffle":
         # Choose two tag Ids at random
-        tag_i, tag_j = random.sample(list(unique_ids), k=2)
+        tag_i, tag_j = random.Random(seed).sample(list(unique_ids), k=2)
+        id_map = tags[swap_permutation(numpy.arange(len(tags), dtype=numpy.int32), numpy.searchsorted(
+            tags, tag_i), numpy.searchsorted(tags, tag_j))]
 
-        transformed_df_1 = shuffle_i_and_j(df=df_1, tag_i=tag_i, tag_j=tag_j)
-        transformed_df_2 = shuffle_i_and_j(df=df_2, tag_i=tag_i, tag_j=tag_j)
+    return [update_processed_time(permute_processed_ids(df=coded_df, id_map=id_map), iter) for coded_df in coded_dfs]
 
-        transformed_df_1 = update_time(transformed_df_1, iter)
-        transformed_df_2 = update_time(transformed_df_2, iter)
 
-        dfs.append(transformed_df_1)
-        dfs.append(transformed_df_2)
+def get_base_days(df_1: pd.DataFrame, df_2: pd.DataFrame):
+    """The 2 processed days, the same days coded by tags, tags and the unique ids of the 2 days"""
+    processed_df_1 = data_processing(df=df_1)
+    processed_df_2 = data_processing(df=df_2)
+    unique_ids = get_unique_ids(df_1=df_1, df_2=df_2)
+    tags = numpy.sort(unique_ids)
+    coded_dfs = (encode_ids(processed_df_1, tags)[0], encode_ids(processed_df_2, tags)[0])
+    return (processed_df_1, processed_df_2), coded_dfs, tags, unique_ids
 
-        iter += 1
 
-    return [data_processing(df=df) for df in dfs]
+def iter_generating(strategy: str, no_iteration: int, df_1: pd.DataFrame, df_2: pd.DataFrame, seed: int = None) -> Iterator[pd.DataFrame]:
+    """The days of repetitive or random shuffle generation in this process, see parallel_generating"""
+    processed_dfs, coded_dfs, tags, unique_ids = get_base_days(df_1, df_2)
+    yield from processed_dfs
+
+    # the master seed follows random unless given
+    seed = random.randrange(2**32) if seed is None else seed
+    for iter in range(1, no_iteration+1):
+        yield from generate_iteration_days(strategy, iter, get_iteration_seed(seed, strategy, iter), coded_dfs, tags, unique_ids)
+
+
+def parallel_generating(strategy: str, no_iteration: int, df_1: pd.DataFrame, df_2: pd.DataFrame, seed: int = 0, no_workers: int = None) -> Iterator[pd.DataFrame]:
+    """The days of repetitive or random shuffle generation, with the iterations spread over a process pool.
+
+    Each iteration draws from its own seed derived from seed, so the days are the same for any no_workers.
+    Days are yielded in order as soon as they and the ones before are done."""
+    no_workers = os.cpu_count() if no_workers is None else no_workers
+    if no_workers <= 1:
+        yield from iter_generating(strategy=strategy, no_iteration=no_iteration, df_1=df_1, df_2=df_2, seed=seed)
+        return
+
+    processed_dfs, coded_dfs, tags, unique_ids = get_base_days(df_1, df_2)
+    yield from processed_dfs
+
+    worker_args = (*coded_dfs, tags, unique_ids)
+    tasks = [(strategy, iter, get_iteration_seed(seed, strategy, iter))
+             for iter in range(1, no_iteration+1)]
+
+    with ProcessPoolExecutor(max_workers=no_workers, initializer=init_generation_worker, initargs=worker_args) as executor:
+        # map returns the iterations in order
+        for days in executor.map(generate_iteration, tasks, chunksize=max(1, no_iteration//(4*no_workers))):
+            yield from days
 
 
 def constrained_shuffle_generating(no_iteration: int, df_1: pd.DataFrame, df_2: pd.DataFrame) -> List[pd.DataFrame]:
@@ -151,6 +442,12 @@ def constrained_shuffle_generating(no_iteration: int, df_1: pd.DataFrame, df_2:
     dfs = [df_1.copy(), df_2.copy()]
     unique_ids = get_unique_ids(df_1=df_1, df_2=df_2)
 
+    # a proposal only changes the f of i, j and the neighbors of i, they are scored from the neighbor sets of both days
+    days = (get_neighbor_sets(df_1), get_neighbor_sets(df_2))
+    f_scores = dict(zip(unique_ids.tolist(), compute_f_scores(
+        unique_ids, get_neighbor_index(df_1, unique_ids), get_neighbor_index(df_2, unique_ids)).tolist()))
+    sum_f_scores = sum(f_scores.values())
+
     iter = 1
     loop_count = 1
 
@@ -158,11 +455,9 @@ def constrained_shuffle_generating(no_iteration: int, df_1: pd.DataFrame, df_2:
         # Choose two tag Ids at random
         tag_i, tag_j = random.sample(list(unique_ids), k=2)
 
-        transformed_df_1 = replace_i_with_j(df=df_1, tag_i=tag_i, tag_j=tag_j)
-        transformed_df_2 = replace_i_with_j(df=df_2, tag_i=tag_i, tag_j=tag_j)
-
         # compute f
-        f = compute_avg_f(df_1=transformed_df_1, df_2=transformed_df_2)
+        f = compute_replaced_avg_f(
+            f_scores, sum_f_scores, days, tag_i=tag_i, tag_j=tag_j)
 
         new_squared_deviation = ((f-f_emp)**2)
 
@@ -170,6 +465,12 @@ def constrained_shuffle_generating(no_iteration: int, df_1: pd.DataFrame, df_2:
             print("2-day data: {} is created at the loop: {} with squared_deviation: {} by replace {} with {}".format(
                 iter, loop_count, new_squared_deviation, tag_i, tag_j))
 
+            # only accepted proposals are applied to the data
+            transformed_df_1 = replace_i_with_j(
+                df=df_1, tag_i=tag_i, tag_j=tag_j)
+            transformed_df_2 = replace_i_with_j(
+                df=df_2, tag_i=tag_i, tag_j=tag_j)
+
             transformed_df_1 = update_time(transformed_df_1, iter)
             transformed_df_2 = update_time(transformed_df_2, iter)
 
@@ -190,35 +491,34 @@ if __name__ == "__main__":
     no_iteration = 49
 
     input_file = "conference_attendance_data.csv"
-    output_file = "synthetic_conference_attendance_data.pkl"
+    # one directory of .npy columns per strategy and day, see ContactStore
+    output_directory = "synthetic_conference_attendance_data"
 
     # input_file = "test_data.csv"
-    # output_file = "synthetic_conference_attendance_data.pkl"
+    # output_directory = "synthetic_conference_attendance_data"
+
+    # the 2 days of the trace are separated by a night without contacts,
+    # the time for day 2 starts with 86400 = 24*60*60
+    df_1, df_2 = list(iter_csv_days(input_file, gap=6*60*60))[:2]
 
-    df = pd.read_csv(input_file)
+    # ids are dense int32 codes during the generation and in the store, tags[code] is the original id
+    _, tags = encode_ids(pd.concat([df_1, df_2]))
+    df_1, df_2 = encode_ids(df_1, tags)[0], encode_ids(df_2, tags)[0]
 
-    split_index = (df["time"] == 83400).idxmax()
-    df_1 = df.iloc[:split_index]
-    df_2 = df.iloc[split_index:]
-    # make the time for day 2 starts with 86400 = 24*60*60
-    df_2["time"] = df_2["time"] + 86400-83400
+    store = ContactStore(output_directory)
+
+    # iterations of the repetitive and random shuffle generation run on all cores
+    # days are written to the store as they are generated
+    seed = 0
 
     print("repetitive_generating...")
-    repetitive_generating_dfs = repetitive_generating(
-        no_iteration=no_iteration, df_1=df_1, df_2=df_2)
+    store.write_days("repetitive_generating_dfs", parallel_generating(
+        strategy="repetitive", no_iteration=no_iteration, df_1=df_1, df_2=df_2, seed=seed), tags=tags)
 
     print("random_shuffle_generating...")
-    random_shuffle_generating_dfs = random_shuffle_generating(
-        no_iteration=no_iteration, df_1=df_1, df_2=df_2)
-
-    # print("constrained_shuffle_generating...")
-    # constrained_shuffle_dfs = constrained_shuffle_generating(
-    #     no_iteration=no_iteration, df_1=df_1, df_2=df_2)
-
-    with open(output_file, 'wb') as file:
-        pickle.dump(
-            {"repetitive_generating_dfs": repetitive_generating_dfs}, file)
-        pickle.dump(
-            {"random_shuffle_generating_dfs": random_shuffle_generating_dfs}, file)
-    # pickle.dump(
-    #     {"constrained_shuffle_dfs": constrained_shuffle_dfs}, file)
+    store.write_days("random_shuffle_generating_dfs", parallel_generating(
+        strategy="random_shuffle", no_iteration=no_iteration, df_1=df_1, df_2=df_2, seed=seed), tags=tags)
+
+    print("constrained_shuffle_generating...")
+    store.write_days("constrained_shuffle_dfs", constrained_shuffle_generating(
+        no_iteration=no_iteration, df_1=df_1, df_2=df_2), tags=tags)
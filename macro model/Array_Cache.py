@@ -0,0 +1,91 @@
+from typing import Dict, List
+import hashlib
+import os
+import shutil
+import tempfile
+import numpy as np
+import pandas as pd
+
+# bump when the layout of cached arrays changes, older entries are then never read again
+CACHE_VERSION = 3
+
+
+class ArrayCache():
+    """On-disk cache of numpy arrays computed from contact dfs, such as built trajectory networks.
+
+    An entry is a directory of .npy files named after the builder and a hash of the input dfs, so changing the
+    inputs changes the key. Arrays are memory-mapped back read-only. When the entries take more than max_bytes,
+    the least recently used ones are deleted."""
+
+    def __init__(self, directory: str, max_bytes: int = 2**30):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        os.makedirs(self.directory, exist_ok=True)
+
+    def get_key(self, kind: str, list_of_dfs: List[pd.DataFrame], columns: List[str], arrays: List[np.ndarray] = ()) -> str:
+        """kind and a digest of the given columns of the dfs and of the other input arrays"""
+        digest = hashlib.blake2b(digest_size=16)
+        digest.update(str(CACHE_VERSION).encode())
+        for df in list_of_dfs:
+            digest.update(len(df).to_bytes(8, 'little'))
+            digest.update(pd.util.hash_pandas_object(
+                df[columns], index=False).to_numpy().tobytes())
+        for array in arrays:
+            array = np.ascontiguousarray(array)
+            digest.update(array.dtype.str.encode())
+            digest.update(len(array).to_bytes(8, 'little'))
+            digest.update(array.tobytes())
+        return "{}-{}".format(kind, digest.hexdigest())
+
+    def load(self, key: str) -> Dict[str, np.ndarray]:
+        """The arrays stored under key, None if there are none"""
+        path = os.path.join(self.directory, key)
+        if not os.path.isdir(path):
+            return None
+        try:
+            arrays = {name[:-4]: np.load(os.path.join(path, name), mmap_mode='r')
+                      for name in os.listdir(path) if name.endswith('.npy')}
+        except (OSError, ValueError):
+            # a damaged entry is rebuilt
+            shutil.rmtree(path, ignore_errors=True)
+            return None
+
+        # the entry is recently used
+        os.utime(path)
+        return arrays
+
+    def store(self, key: str, arrays: Dict[str, np.ndarray]):
+        # arrays are written to a temporary directory first, so a reader never sees a partial entry
+        path = os.path.join(self.directory, key)
+        temporary_path = tempfile.mkdtemp(dir=self.directory, prefix='.tmp-')
+        for name, array in arrays.items():
+            np.save(os.path.join(temporary_path, name + '.npy'),
+                    np.ascontiguousarray(array))
+        try:
+            os.rename(temporary_path, path)
+        except OSError:
+            # another process stored the same entry
+            shutil.rmtree(temporary_path, ignore_errors=True)
+        self.evict()
+
+    def evict(self):
+        """Delete the least recently used entries until the cache fits in max_bytes"""
+        entries = []
+        for key in os.listdir(self.directory):
+            path = os.path.join(self.directory, key)
+            if key.startswith('.') or not os.path.isdir(path):
+                continue
+            size = sum(os.path.getsize(os.path.join(path, name))
+                       for name in os.listdir(path))
+            entries.append((os.path.getmtime(path), size, path))
+
+        total_bytes = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total_bytes <= self.max_bytes:
+                break
+            shutil.rmtree(path, ignore_errors=True)
+            total_bytes -= size
+
+    def clear(self):
+        for key in os.listdir(self.directory):
+            shutil.rmtree(os.path.join(self.directory, key), ignore_errors=True)
@@ -1,31 +1,21 @@
+from SEIR_History import SEIRHistory, SUSCEPTIBLE, EXPOSED, INFECTIOUS, RECOVERED
+from Observation_Schedule import ObservationSchedule
+from Dynamic_SEIR_Base import DynamicSEIRBase
+from Instrumentation import Instrumentation
 from collections import defaultdict
 import random
 import pandas as pd
 import numpy as np
 
 
-class DynamicSEIR():
-    def __init__(self, df: pd.DataFrame, s_initial: set, i_initial: set, infect_rate: float, t_incubation: float, t_recovery: float, t_loss_immunity: float):
-        self.df = df
+class DynamicSEIR(DynamicSEIRBase):
+    def __init__(self, df: pd.DataFrame, s_initial: set, i_initial: set, infect_rate: float, t_incubation: float, t_recovery: float, t_loss_immunity: float, observation_schedule: ObservationSchedule = None, tags: np.ndarray = None, instrumentation: Instrumentation = None):
+        super().__init__(df=df, s_initial=s_initial, i_initial=i_initial, infect_rate=infect_rate, t_incubation=t_incubation,
+                         t_recovery=t_recovery, t_loss_immunity=t_loss_immunity, observation_schedule=observation_schedule,
+                         tags=tags, instrumentation=instrumentation)
 
-        self.susceptible_population = s_initial.copy()
-        self.exposed_population = set()
-        self.infectious_population = i_initial.copy()
-        self.recovered_population = set()
-
-        # SEIR at each time step
-        self.SEIR_population = {0: [self.susceptible_population.copy(), self.exposed_population.copy(
-        ), self.infectious_population.copy(), self.recovered_population.copy()]}
-
-        # infect probability depends on infect rate and contact duration
-        self.infect_rate = infect_rate
-
-        # Exposed -> Infectious after t_incubation
-        self.t_incubation = t_incubation
-        # Infectious -> Recovered after t_recovery
-        self.t_recovery = t_recovery
-        # Recovered -> Suceptible after t_loss_immunity
-        self.t_loss_immunity = t_loss_immunity
+        # SEIR at each time step, rebuilt from the transition log
+        self.SEIR_population = SEIRHistory(initial_states=self.states, tags=self.tags)
 
         # incubation starting time point of each person
         self.incubation_start_moment = defaultdict(int)
@@ -34,16 +24,29 @@ class DynamicSEIR():
         # losing immunity starting time point of each person
         self.loss_immunity_start_moment = defaultdict(int)
 
-        # all people's id
-        self.ids = s_initial.union(i_initial)
-
-        self.epidemic_spreading()
-
-    def calculate_infect_probability(self, contact_duration: float) -> float:
-        """The probability of infection between 2 individuals after contact_duration, given their total_contact_duration_in_the_same_timestep """
-        # see Stehlé et al. BMC Medicine 2011
-        infect_probability = self.infect_rate*contact_duration
-        return infect_probability
+        # end of the interval being processed, the time at which status changes are recorded
+        self.interval_end_moment = 0
+
+        name = self.instrumentation_prefix
+        self.instrument_handlers(name)
+        self.instrumentation.run(name + ".run", self.epidemic_spreading)
+        self.instrumentation.record_history(name, self.SEIR_population)
+
+    def instrument_handlers(self, name: str):
+        # each interaction handler counts its calls, the methods are left untouched when disabled
+        for handler in ("Susceptible_and_Exposed_interaction", "Susceptible_and_Infectious_interaction",
+                        "Exposed_and_Recovered_interation", "Infectious_and_Recovered_interaction"):
+            if self.instrumentation.enabled:
+                setattr(self, handler, self.instrumentation.counted(
+                    "{}.handled.{}".format(name, handler), getattr(self, handler)))
+
+    def change_state(self, id, state, moment):
+        # the change is seen at the end of the interval processing it, as in a snapshot taken after each interval,
+        # so the log stays sorted by time even when moment lies in an earlier interval
+        if self.state_buffer[id] != state:
+            self.SEIR_population.record(
+                time=self.interval_end_moment, id=id, from_state=self.state_buffer[id], to_state=state)
+            self.state_buffer[id] = state
 
     def exposed_to_infectious_moment(self, id) -> float:
         return self.t_incubation + self.incubation_start_moment[id]
@@ -56,22 +59,19 @@ class DynamicSEIR():
 
     def susceptible_to_exposed(self, id, moment):
         self.incubation_start_moment[id] = moment
-        self.susceptible_population.discard(id)
-        self.exposed_population.add(id)
+        self.change_state(id=id, state=EXPOSED, moment=moment)
 
     def exposed_to_infectious(self, id, moment):
         self.recovery_start_moment[id] = moment
-        self.exposed_population.discard(id)
-        self.infectious_population.add(id)
+        self.change_state(id=id, state=INFECTIOUS, moment=moment)
 
     def infectious_to_recovered(self, id, moment):
         self.loss_immunity_start_moment[id] = moment
-        self.infectious_population.discard(id)
-        self.recovered_population.add(id)
+        self.change_state(id=id, state=RECOVERED, moment=moment)
 
     def recovered_to_susceptible(self, id):
-        self.recovered_population.discard(id)
-        self.susceptible_population.add(id)
+        self.change_state(id=id, state=SUSCEPTIBLE,
+                          moment=self.recovered_to_susceptible_moment(id))
 
     def Susceptible_and_Exposed_interaction(self, contact_end_moment, interval_end_moment, id_1, id_2):
         # id_1: Susceptible and id_2: Exposed
@@ -137,101 +137,124 @@ class DynamicSEIR():
                 self.susceptible_to_exposed(id=id_2, moment=min(
                     t1, contact_end_moment, interval_end_moment))
 
+    def interact(self, state_1, state_2, id_1, id_2, contact_start_moment, contact_end_moment, interval_end_moment) -> bool:
+        """Run the interaction handler of a contact given the status of its people at the start of the interval,
+        False if no handler matches their status"""
+        if state_1 == SUSCEPTIBLE and state_2 == EXPOSED:
+            self.Susceptible_and_Exposed_interaction(
+                contact_end_moment=contact_end_moment, interval_end_moment=interval_end_moment, id_1=id_1, id_2=id_2)
+        elif state_2 == SUSCEPTIBLE and state_1 == EXPOSED:
+            self.Susceptible_and_Exposed_interaction(
+                contact_end_moment=contact_end_moment, interval_end_moment=interval_end_moment, id_1=id_2, id_2=id_1)
+        elif state_1 == SUSCEPTIBLE and state_2 == INFECTIOUS:
+            self.Susceptible_and_Infectious_interaction(
+                contact_start_moment=contact_start_moment, contact_end_moment=contact_end_moment, interval_end_moment=interval_end_moment, id_1=id_1, id_2=id_2)
+        elif state_2 == SUSCEPTIBLE and state_1 == INFECTIOUS:
+            self.Susceptible_and_Infectious_interaction(
+                contact_start_moment=contact_start_moment, contact_end_moment=contact_end_moment, interval_end_moment=interval_end_moment, id_1=id_2, id_2=id_1)
+        elif state_1 == EXPOSED and state_2 == RECOVERED:
+            self.Exposed_and_Recovered_interation(
+                contact_end_moment=contact_end_moment, interval_end_moment=interval_end_moment, id_1=id_1, id_2=id_2)
+        elif state_2 == EXPOSED and state_1 == RECOVERED:
+            self.Exposed_and_Recovered_interation(
+                contact_end_moment=contact_end_moment, interval_end_moment=interval_end_moment, id_1=id_2, id_2=id_1)
+        elif state_1 == INFECTIOUS and state_2 == RECOVERED:
+            self.Infectious_and_Recovered_interaction(
+                contact_end_moment=contact_end_moment, interval_end_moment=interval_end_moment, id_1=id_1, id_2=id_2)
+        elif state_2 == INFECTIOUS and state_1 == RECOVERED:
+            self.Infectious_and_Recovered_interaction(
+                contact_end_moment=contact_end_moment, interval_end_moment=interval_end_moment, id_1=id_2, id_2=id_1)
+        else:
+            return False
+        return True
+
+    def update_status(self, id, state, interval_end_moment):
+        """Status change of a person who had no handled contact during the interval, given its status at the start"""
+        if state == EXPOSED:
+            t = self.exposed_to_infectious_moment(id)
+            if t <= interval_end_moment:
+                self.exposed_to_infectious(id=id, moment=t)
+        elif state == INFECTIOUS:
+            t = self.infectious_to_recovered_moment(id)
+            if t <= interval_end_moment:
+                self.infectious_to_recovered(id=id, moment=t)
+        elif state == RECOVERED:
+            t = self.recovered_to_susceptible_moment(id)
+            if t <= interval_end_moment:
+                self.recovered_to_susceptible(id=id)
+
     def epidemic_spreading(self):
-        df = self.df
-        moments = np.sort(np.unique(df[['start_moment', 'end_moment']]))
+        # the arrays are read through memoryviews, which give Python numbers without copying them into lists
+        contact_id_1 = memoryview(self.contact_id_1)
+        contact_id_2 = memoryview(self.contact_id_2)
+        contact_start_moment = memoryview(self.contact_start_moment)
+        contact_end_moment = memoryview(self.contact_end_moment)
+
+        moments = memoryview(self.moments)
+        no_contacts = len(contact_id_1)
+        no_intervals = max(len(moments)-1, 0)
+        self.SEIR_population.time_points = self.get_time_points()
 
         start_row_index = 0
 
-        for idx, interval_start_moment in enumerate(moments):
-            if idx == len(moments)-1:
-                break
+        timer = self.instrumentation.lap_timer(self.instrumentation_prefix)
+        contacts_scanned = people_updated = 0
 
+        for idx in range(no_intervals):
+            interval_start_moment = moments[idx]
             interval_end_moment = moments[idx+1]
+            self.interval_end_moment = interval_end_moment
             processed_ids = set()
+            timer.start()
+
+            # status of everyone at the start of the interval
+            states = bytes(self.state_buffer)
 
-            susceptible_population = self.susceptible_population.copy()
-            exposed_population = self.exposed_population.copy()
-            infectious_population = self.infectious_population.copy()
-            recovered_population = self.recovered_population.copy()
+            timer.lap("snapshot")
+            first_row = start_row_index
+            row = first_row - 1
 
             # process all contacts during the interval
-            for _, row in df.iloc[start_row_index:].iterrows():
-                if row["end_moment"] <= interval_start_moment:
+            for row in range(start_row_index, no_contacts):
+                if contact_end_moment[row] <= interval_start_moment:
                     start_row_index += 1
                     continue
-                elif interval_start_moment < row["start_moment"]:
+                elif interval_start_moment < contact_start_moment[row]:
                     break
 
-                # when row["start_moment"] <= interval_start_moment < row["end_moment"]
-
-                if row["id_1"] in susceptible_population and row["id_2"] in exposed_population:
-                    processed_ids.add(row["id_1"])
-                    processed_ids.add(row["id_2"])
-                    self.Susceptible_and_Exposed_interaction(
-                        contact_end_moment=row["end_moment"], interval_end_moment=interval_end_moment, id_1=row["id_1"], id_2=row["id_2"])
-                elif row["id_2"] in susceptible_population and row["id_1"] in exposed_population:
-                    processed_ids.add(row["id_1"])
-                    processed_ids.add(row["id_2"])
-                    self.Susceptible_and_Exposed_interaction(
-                        contact_end_moment=row["end_moment"], interval_end_moment=interval_end_moment, id_1=row["id_2"], id_2=row["id_1"])
-                elif row["id_1"] in susceptible_population and row["id_2"] in infectious_population:
-                    processed_ids.add(row["id_1"])
-                    processed_ids.add(row["id_2"])
-                    self.Susceptible_and_Infectious_interaction(
-                        contact_start_moment=row["start_moment"], contact_end_moment=row["end_moment"], interval_end_moment=interval_end_moment, id_1=row["id_1"], id_2=row["id_2"])
-                elif row["id_2"] in susceptible_population and row["id_1"] in infectious_population:
-                    processed_ids.add(row["id_1"])
-                    processed_ids.add(row["id_2"])
-                    self.Susceptible_and_Infectious_interaction(
-                        contact_start_moment=row["start_moment"], contact_end_moment=row["end_moment"], interval_end_moment=interval_end_moment, id_1=row["id_2"], id_2=row["id_1"])
-                elif row["id_1"] in exposed_population and row["id_2"] in recovered_population:
-                    processed_ids.add(row["id_1"])
-                    processed_ids.add(row["id_2"])
-                    self.Exposed_and_Recovered_interation(
-                        contact_end_moment=row["end_moment"], interval_end_moment=interval_end_moment, id_1=row["id_1"], id_2=row["id_2"])
-                elif row["id_2"] in exposed_population and row["id_1"] in recovered_population:
-                    processed_ids.add(row["id_1"])
-                    processed_ids.add(row["id_2"])
-                    self.Exposed_and_Recovered_interation(
-                        contact_end_moment=row["end_moment"], interval_end_moment=interval_end_moment, id_1=row["id_2"], id_2=row["id_1"])
-                elif row["id_1"] in infectious_population and row["id_2"] in recovered_population:
-                    processed_ids.add(row["id_1"])
-                    processed_ids.add(row["id_2"])
-                    self.Infectious_and_Recovered_interaction(
-                        contact_end_moment=row["end_moment"], interval_end_moment=interval_end_moment, id_1=row["id_1"], id_2=row["id_2"])
-                elif row["id_2"] in infectious_population and row["id_1"] in recovered_population:
-                    processed_ids.add(row["id_1"])
-                    processed_ids.add(row["id_2"])
-                    self.Infectious_and_Recovered_interaction(
-                        contact_end_moment=row["end_moment"], interval_end_moment=interval_end_moment, id_1=row["id_2"], id_2=row["id_1"])
-                else:
-                    pass
+                # when contact_start_moment[row] <= interval_start_moment < contact_end_moment[row]
+                id_1 = contact_id_1[row]
+                id_2 = contact_id_2[row]
+                if self.interact(state_1=states[id_1], state_2=states[id_2], id_1=id_1, id_2=id_2, contact_start_moment=contact_start_moment[row],
+                                 contact_end_moment=contact_end_moment[row], interval_end_moment=interval_end_moment):
+                    processed_ids.add(id_1)
+                    processed_ids.add(id_2)
+
+            timer.lap("contact_scan")
+            # rows from the first one of the interval to the one stopping the scan
+            contacts_scanned += row - first_row + 1
+            people_updated += len(self.ids) - len(processed_ids)
 
             # update other people's status
             for id in self.ids:
                 if id not in processed_ids:
-                    if id in exposed_population:
-                        t = self.exposed_to_infectious_moment(id)
-                        if t <= interval_end_moment:
-                            self.exposed_to_infectious(id=id, moment=t)
-                    elif id in infectious_population:
-                        t = self.infectious_to_recovered_moment(id)
-                        if t <= interval_end_moment:
-                            self.infectious_to_recovered(id=id, moment=t)
-                    elif id in recovered_population:
-                        t = self.recovered_to_susceptible_moment(id)
-                        if t <= interval_end_moment:
-                            self.recovered_to_susceptible(id=id)
-                    else:
-                        pass
-
-            self.SEIR_population[interval_end_moment] = [self.susceptible_population.copy(
-            ), self.exposed_population.copy(), self.infectious_population.copy(), self.recovered_population.copy()]
-
+                    state = states[id]
+                    if state != SUSCEPTIBLE:
+                        self.update_status(
+                            id=id, state=state, interval_end_moment=interval_end_moment)
+            timer.lap("status_update")
+
+        timer.stop()
+        self.instrumentation.count_all(self.instrumentation_prefix, intervals=no_intervals,
+                                       contacts_scanned=contacts_scanned, people_updated=people_updated)
         return
 
     def get_num_SEIR(self):
         # dim: days x 4
         # the number people of each group S, E, I , R over time
-        return [[len(s) for s in SEIR_t] for end_time, SEIR_t in self.SEIR_population.items()]
+        return self.SEIR_population.get_num_SEIR()
+
+    def get_num_SEIR_at(self, times) -> np.ndarray:
+        # dim: len(times) x 4
+        # the number people of each group S, E, I , R at any times
+        return self.SEIR_population.counts_at(times)
@@ -0,0 +1,105 @@
+from SEIR_History import SUSCEPTIBLE, INFECTIOUS
+from Observation_Schedule import ObservationSchedule
+from Instrumentation import Instrumentation, Instrumented
+import pandas as pd
+import numpy as np
+
+
+class DynamicSEIRBase(Instrumented):
+    """People, contacts and parameters of the SEIR models running on a table of contacts with start and end moments.
+
+    The contacts are processed in the intervals between consecutive moments, see DynamicSEIR. When tags is given,
+    id_1 and id_2 of df are dense codes of the people (as in a coded ContactStore), tags[code] being the id of code."""
+
+    def __init__(self, df: pd.DataFrame, s_initial: set, i_initial: set, infect_rate: float, t_incubation: float, t_recovery: float, t_loss_immunity: float, observation_schedule: ObservationSchedule = None, tags: np.ndarray = None, instrumentation: Instrumentation = None):
+        # timers and counters of the run, see report
+        self.set_instrumentation(instrumentation)
+        setup_timer = self.instrumentation.lap_timer(self.instrumentation_prefix)
+        setup_timer.start()
+
+        # all people's id remapped to dense indices, tags[index] is the original id
+        # contacts as arrays instead of df rows, the moments are the columns of df when they are numeric
+        if tags is None:
+            self.tags = np.unique(np.concatenate([df['id_1'].to_numpy(), df['id_2'].to_numpy(),
+                                                  np.array(list(s_initial.union(i_initial)), dtype=np.int64)]))
+            self.contact_id_1 = np.searchsorted(self.tags, df['id_1'].to_numpy()).astype(np.int32)
+            self.contact_id_2 = np.searchsorted(self.tags, df['id_2'].to_numpy()).astype(np.int32)
+        else:
+            # the codes are the indices, people of s_initial and i_initial without contacts come after the tags
+            missing = s_initial.union(i_initial).difference(tags.tolist())
+            self.tags = np.concatenate([tags, np.array(sorted(missing), dtype=tags.dtype)])
+            self.contact_id_1 = df['id_1'].to_numpy().astype(np.int32, copy=False)
+            self.contact_id_2 = df['id_2'].to_numpy().astype(np.int32, copy=False)
+        self.tag_to_index = {tag: index for index, tag in enumerate(self.tags.tolist())}
+
+        self.contact_start_moment = self.to_moments(df['start_moment'])
+        self.contact_end_moment = self.to_moments(df['end_moment'])
+
+        # status of each person (SUSCEPTIBLE, EXPOSED, INFECTIOUS or RECOVERED) indexed by dense index,
+        # -1 for people who are neither in s_initial nor in i_initial
+        # the bytearray gives fast access in the interval loop, self.states is an int8 view of it
+        self.state_buffer = bytearray(b'\xff'*len(self.tags))
+        self.states = np.frombuffer(self.state_buffer, dtype=np.int8)
+        self.states[list(self.to_indices(s_initial))] = SUSCEPTIBLE
+        self.states[list(self.to_indices(i_initial))] = INFECTIOUS
+
+        # infect probability depends on infect rate and contact duration
+        self.infect_rate = infect_rate
+
+        # Exposed -> Infectious after t_incubation
+        self.t_incubation = t_incubation
+        # Infectious -> Recovered after t_recovery
+        self.t_recovery = t_recovery
+        # Recovered -> Suceptible after t_loss_immunity
+        self.t_loss_immunity = t_loss_immunity
+
+        # all people's id
+        self.ids = self.to_indices(s_initial.union(i_initial))
+
+        # times reported by get_num_SEIR, the end of every interval if None
+        self.observation_schedule = observation_schedule
+
+        # sorted distinct start and end moments of the contacts
+        self.moments = self.get_moments()
+
+        setup_timer.lap("setup")
+        setup_timer.stop()
+
+    def get_moments(self) -> np.ndarray:
+        return np.unique(np.concatenate(
+            [self.contact_start_moment, self.contact_end_moment]))
+
+    def to_moments(self, column: pd.Series) -> np.ndarray:
+        moments = column.to_numpy()
+        return moments if moments.dtype.kind in "iuf" else moments.astype(np.float64)
+
+    def to_indices(self, tags: set) -> set:
+        return {self.tag_to_index[tag] for tag in tags}
+
+    def get_time_points(self) -> list:
+        """The observation times, or 0 and the end of every interval between consecutive moments"""
+        if self.observation_schedule is None:
+            return [0] + self.moments[1:].tolist()
+        return self.observation_schedule.get_times(end=self.moments[-1] if len(self.moments) > 0 else 0).tolist()
+
+    def calculate_infect_probability(self, contact_duration: float) -> float:
+        """The probability of infection between 2 individuals after contact_duration, given their total_contact_duration_in_the_same_timestep """
+        # see Stehlé et al. BMC Medicine 2011
+        infect_probability = self.infect_rate*contact_duration
+        return infect_probability
+
+    def get_scanned_rows(self):
+        """Rows of the contacts processed in each interval by the scan of DynamicSEIR, for rows sorted by end moment.
+
+        Interval k processes rows first_rows[k] to last_rows[k]-1, and row r is processed from interval
+        first_intervals[r] to interval end_intervals[r]-1."""
+        start_intervals = np.searchsorted(self.moments, self.contact_start_moment)
+        end_intervals = np.searchsorted(self.moments, self.contact_end_moment)
+        # the scan stops at the first contact which has not started, so a contact is processed once all the
+        # contacts before it have started
+        first_intervals = np.maximum.accumulate(start_intervals)
+
+        intervals = np.arange(max(len(self.moments)-1, 0))
+        first_rows = np.searchsorted(end_intervals, intervals, side='right')
+        last_rows = np.searchsorted(first_intervals, intervals, side='right')
+        return first_rows, last_rows, first_intervals, end_intervals
@@ -0,0 +1,196 @@
+from Dynamic_SEIR_Base import DynamicSEIRBase
+from SEIR_History import SUSCEPTIBLE, EXPOSED, INFECTIOUS, RECOVERED
+from Observation_Schedule import ObservationSchedule
+from Instrumentation import Instrumentation
+import pandas as pd
+import numpy as np
+
+
+class DynamicSEIREnsemble(DynamicSEIRBase):
+    """no_replicas realisations of DynamicSEIR simulated together.
+
+    The intervals between consecutive moments are processed in order as in DynamicSEIR, with the status of each person
+    in each replica kept in a replicas x people matrix. The trials of the contacts processed in an interval are drawn
+    for all replicas at once, with the rules of the interaction handlers of DynamicSEIR. The replicas use their own
+    random generator, so they follow the distribution of DynamicSEIR runs but not their random sequence.
+
+    As for DynamicSEIR, the rows of df must be sorted by end_moment. get_num_SEIR returns a no_replicas x time points x 4
+    array, so an observation_schedule should be given for long contact tables. The replicas keep no transition log,
+    so there is no SEIR_population."""
+
+    def __init__(self, df: pd.DataFrame, s_initial: set, i_initial: set, infect_rate: float, t_incubation: float, t_recovery: float, t_loss_immunity: float, no_replicas: int, observation_schedule: ObservationSchedule = None, seed=None, tags: np.ndarray = None, instrumentation: Instrumentation = None):
+        super().__init__(df=df, s_initial=s_initial, i_initial=i_initial, infect_rate=infect_rate, t_incubation=t_incubation,
+                         t_recovery=t_recovery, t_loss_immunity=t_loss_immunity, observation_schedule=observation_schedule,
+                         tags=tags, instrumentation=instrumentation)
+        self.no_replicas = no_replicas
+        self.rng = np.random.default_rng(seed)
+
+        self.instrumentation.run(
+            self.instrumentation_prefix + ".run", self.epidemic_spreading)
+
+    def epidemic_spreading(self):
+        moments = memoryview(self.moments)
+        self.time_points = self.get_time_points()
+        time_points = np.asarray(self.time_points, dtype=np.float64)
+        no_intervals = max(len(moments)-1, 0)
+        first_rows, last_rows, _, _ = self.get_scanned_rows()
+
+        # dim: replicas x people
+        self.replica_states = np.tile(self.states, (self.no_replicas, 1))
+        # moment of the next status change of each person without contacts, the starting moments are 0 at first
+        self.due_moments = np.where(
+            self.replica_states == INFECTIOUS, float(self.t_recovery), np.inf)
+
+        # dim: replicas x time points x 4
+        self.num_SEIR = np.zeros(
+            (self.no_replicas, len(self.time_points), 4), dtype=np.int64)
+        counts = self.count_SEIR()
+        time_index = 0
+
+        spreading = self.get_spreading()
+        next_due_moment = self.due_moments.min(initial=np.inf)
+        no_visited = contacts_scanned = 0
+
+        interval = 0
+        while interval < no_intervals:
+            if not spreading.any():
+                # only due status changes can happen until someone is exposed again
+                interval = max(interval, int(np.searchsorted(
+                    self.moments, next_due_moment)) - 1)
+                if interval >= no_intervals:
+                    break
+            interval_end_moment = moments[interval+1]
+
+            # the time points before the end of the interval see the status at its start
+            next_time_index = np.searchsorted(
+                time_points, interval_end_moment, side='left')
+            self.num_SEIR[:, time_index:next_time_index] = counts[:, None]
+            time_index = max(time_index, next_time_index)
+
+            # contacts processed by DynamicSEIR in the interval with an exposed or infectious person in some replica
+            rows = np.arange(first_rows[interval], last_rows[interval])
+            rows = rows[spreading[self.contact_id_1[rows]] |
+                        spreading[self.contact_id_2[rows]]]
+
+            due = next_due_moment <= interval_end_moment
+            if len(rows) > 0 or due:
+                no_visited += 1
+                contacts_scanned += len(rows)
+                if self.spread(rows, interval_end_moment, due):
+                    counts = self.count_SEIR()
+                    spreading = self.get_spreading()
+                    next_due_moment = self.due_moments.min(initial=np.inf)
+            interval += 1
+
+        self.num_SEIR[:, time_index:] = counts[:, None]
+        self.instrumentation.count_all(self.instrumentation_prefix, intervals=no_visited,
+                                       contacts_scanned=contacts_scanned)
+        return
+
+    def spread(self, rows: np.ndarray, interval_end_moment: float, due: bool) -> bool:
+        """Status changes of all replicas during the interval ending at interval_end_moment, rows are its contacts
+        with an exposed or infectious person and due tells whether some status change is due, False if nothing changes"""
+        states = self.replica_states
+        due_moments = self.due_moments
+
+        # every handler of DynamicSEIR runs on a contact between an exposed or infectious person, the source,
+        # and a susceptible or recovered one, the target
+        id_1 = self.contact_id_1[rows]
+        id_2 = self.contact_id_2[rows]
+        state_1 = states[:, id_1]
+        state_2 = states[:, id_2]
+        spreader_1 = (state_1 == EXPOSED) | (state_1 == INFECTIOUS)
+        spreader_2 = (state_2 == EXPOSED) | (state_2 == INFECTIOUS)
+        target_1 = (state_1 == SUSCEPTIBLE) | (state_1 == RECOVERED)
+        target_2 = (state_2 == SUSCEPTIBLE) | (state_2 == RECOVERED)
+        # handled contacts in row order within each replica
+        replicas, columns = np.nonzero(
+            (spreader_1 & target_2) | (spreader_2 & target_1))
+        if len(replicas) == 0 and not due:
+            return False
+
+        first_is_source = spreader_1[replicas, columns]
+        source = np.where(first_is_source, id_1[columns], id_2[columns])
+        target = np.where(first_is_source, id_2[columns], id_1[columns])
+        source_state = states[replicas, source]
+        target_state = states[replicas, target]
+        target_due = due_moments[replicas, target]
+        infected, moment = self.infect(source_state, target_state, due_moments[replicas, source], target_due,
+                                       self.contact_start_moment[rows[columns]], self.contact_end_moment[rows[columns]], interval_end_moment)
+
+        if due:
+            # the status changes due during the interval, of everyone as the handlers make the same ones
+            due_people = due_moments <= interval_end_moment
+            due_states = states[due_people]
+            due_times = due_moments[due_people]
+            states[due_people] = np.where(due_states == EXPOSED, INFECTIOUS, np.where(
+                due_states == INFECTIOUS, RECOVERED, SUSCEPTIBLE))
+            due_moments[due_people] = np.where(due_states == EXPOSED, due_times+self.t_recovery, np.where(
+                due_states == INFECTIOUS, due_times+self.t_loss_immunity, np.inf))
+
+        # a susceptible target is exposed at its last successful trial, a recovered target losing its immunity
+        # becomes susceptible and then exposed again at each of its contacts, so its last contact decides
+        decisive = np.flatnonzero(np.where(
+            target_state == SUSCEPTIBLE, infected, target_due <= interval_end_moment))
+        keys = replicas[decisive]*len(self.tags) + target[decisive]
+        _, last = np.unique(keys[::-1], return_index=True)
+        exposed = decisive[len(decisive) - 1 - last]
+        exposed = exposed[infected[exposed]]
+
+        states[replicas[exposed], target[exposed]] = EXPOSED
+        due_moments[replicas[exposed], target[exposed]] = moment[exposed] + self.t_incubation
+        return due or len(exposed) > 0
+
+    def infect(self, source_state, target_state, source_due, target_due, contact_start_moment, contact_end_moment, interval_end_moment):
+        """Outcome and moment of the trial of each contact, with the rules of the interaction handlers of DynamicSEIR"""
+        last_contact_moment = np.minimum(interval_end_moment, contact_end_moment)
+        exposed_source = source_state == EXPOSED
+        susceptible_target = target_state == SUSCEPTIBLE
+
+        # susceptible and exposed: a trial from the moment the source becomes infectious
+        # susceptible and infectious: a trial over the contact, which always succeeds when the source recovers,
+        # as the handler compares the random number with the recovery moment
+        source_recovers = ~exposed_source & (source_due <= interval_end_moment)
+        susceptible_moment = np.where(source_recovers, np.minimum(
+            source_due, contact_end_moment), last_contact_moment)
+        susceptible_probability = np.where(source_recovers, susceptible_moment, self.calculate_infect_probability(
+            last_contact_moment - np.where(exposed_source, source_due, contact_start_moment)))
+        susceptible_trial = ~exposed_source | (
+            (source_due <= interval_end_moment) & (source_due <= contact_end_moment))
+
+        # exposed and recovered: a trial once both changed status, infectious and recovered: a trial from the moment
+        # the target loses its immunity until the source recovers
+        recovered_moment = np.where(exposed_source, last_contact_moment,
+                                    np.minimum(source_due, last_contact_moment))
+        recovered_probability = self.calculate_infect_probability(
+            recovered_moment - np.where(exposed_source, 0, target_due))
+        recovered_trial = np.where(exposed_source, np.maximum(source_due, target_due) <= last_contact_moment,
+                                   (target_due <= source_due) & (target_due <= last_contact_moment))
+
+        trial = np.where(susceptible_target, susceptible_trial, recovered_trial)
+        probability = np.where(
+            susceptible_target, susceptible_probability, recovered_probability)
+        moment = np.where(susceptible_target,
+                          susceptible_moment, recovered_moment)
+        return trial & (self.rng.random(len(trial)) <= probability), moment
+
+    def get_spreading(self) -> np.ndarray:
+        """Whether each person is exposed or infectious in some replica"""
+        return ((self.replica_states == EXPOSED) | (self.replica_states == INFECTIOUS)).any(axis=0)
+
+    def count_SEIR(self) -> np.ndarray:
+        """Number of people in S, E, I, R in each replica, dim: replicas x 4"""
+        # people outside the population are -1, counted in a fifth column which is dropped
+        offsets = 5*np.arange(self.no_replicas)[:, None] + 1
+        return np.bincount((self.replica_states + offsets).ravel(), minlength=5*self.no_replicas).reshape(-1, 5)[:, 1:]
+
+    def get_num_SEIR(self) -> np.ndarray:
+        # dim: replicas x time points x 4
+        # the number people of each group S, E, I , R over time in each replica
+        return self.num_SEIR
+
+    def get_num_SEIR_at(self, times) -> np.ndarray:
+        # dim: replicas x len(times) x 4
+        # the counts of the last time point at or before each of times, the first time point before it
+        index = np.searchsorted(self.time_points, times, side='right') - 1
+        return self.num_SEIR[:, np.maximum(index, 0)]
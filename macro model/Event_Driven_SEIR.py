@@ -0,0 +1,135 @@
+from Dynamic_SEIR import DynamicSEIR
+from SEIR_History import EXPOSED, INFECTIOUS, RECOVERED
+from bisect import bisect_left, bisect_right
+import heapq
+import numpy as np
+
+
+class EventDrivenSEIR(DynamicSEIR):
+    """DynamicSEIR visiting only the intervals in which something can happen.
+
+    DynamicSEIR scans the contacts of every interval between consecutive moments, then every person. Here an interval
+    is visited when an exposed or infectious person has a contact during it, or when a status change is due, and the
+    intervals to visit are kept in a priority queue. A visited interval runs the same handlers on the same contacts in
+    the same order as DynamicSEIR, so with the same random seed SEIR_population and get_num_SEIR are the same.
+
+    As for DynamicSEIR, the rows of df must be sorted by end_moment, which data_processing does."""
+
+    def epidemic_spreading(self):
+        self.SEIR_population.time_points = self.get_time_points()
+        no_intervals = max(len(self.moments)-1, 0)
+        self.moment_view = memoryview(self.moments)
+
+        # rows scanned by DynamicSEIR in interval k are first_rows[k] to last_rows[k]-1
+        first_rows, last_rows, first_intervals, end_intervals = self.get_scanned_rows()
+        first_rows = first_rows.tolist()
+        last_rows = last_rows.tolist()
+        self.first_intervals = memoryview(first_intervals)
+
+        # rows of each person sorted, person_rows[row_bounds[id]:row_bounds[id+1]]
+        people = np.concatenate([self.contact_id_1, self.contact_id_2])
+        rows = np.tile(np.arange(len(self.contact_id_1)), 2)
+        order = np.lexsort((rows, people))
+        self.person_rows = memoryview(rows[order])
+        self.person_end_intervals = memoryview(end_intervals[rows[order]])
+        self.row_bounds = np.searchsorted(people[order], np.arange(len(self.tags)+1)).tolist()
+
+        contact_id_1 = memoryview(self.contact_id_1)
+        contact_id_2 = memoryview(self.contact_id_2)
+        contact_start_moment = memoryview(self.contact_start_moment)
+        contact_end_moment = memoryview(self.contact_end_moment)
+
+        # (interval, id) entries, an entry is valid while it is the next visit of id for a due status change or a contact
+        self.queue = []
+        self.due_interval = {}
+        self.wake_interval = {}
+        # people whose status or starting moments changed during the interval
+        self.touched = set()
+        for id in self.ids:
+            self.schedule(id, 0)
+
+        no_visited = contacts_scanned = 0
+        while self.queue:
+            interval = self.queue[0][0]
+            if interval >= no_intervals:
+                break
+            visited = set()
+            while self.queue and self.queue[0][0] == interval:
+                _, id = heapq.heappop(self.queue)
+                if self.due_interval.get(id) == interval or self.wake_interval.get(id) == interval:
+                    visited.add(id)
+            if not visited:
+                continue
+
+            interval_end_moment = self.moment_view[interval+1]
+            self.interval_end_moment = interval_end_moment
+            first_row = first_rows[interval]
+            last_row = last_rows[interval]
+            no_visited += 1
+
+            # status at the start of the interval of the visited people and of the contacts of the spreaders
+            states = {id: self.state_buffer[id] for id in visited}
+            spreader_rows = set()
+            for id in visited:
+                if states[id] == EXPOSED or states[id] == INFECTIOUS:
+                    low = bisect_left(self.person_rows, first_row,
+                                      self.row_bounds[id], self.row_bounds[id+1])
+                    spreader_rows.update(self.person_rows[low:bisect_left(
+                        self.person_rows, last_row, low, self.row_bounds[id+1])])
+            contacts = [(row, contact_id_1[row], contact_id_2[row], self.state_buffer[contact_id_1[row]],
+                         self.state_buffer[contact_id_2[row]]) for row in sorted(spreader_rows)]
+            contacts_scanned += len(contacts)
+
+            processed_ids = set()
+            for row, id_1, id_2, state_1, state_2 in contacts:
+                if self.interact(state_1=state_1, state_2=state_2, id_1=id_1, id_2=id_2, contact_start_moment=contact_start_moment[row],
+                                 contact_end_moment=contact_end_moment[row], interval_end_moment=interval_end_moment):
+                    processed_ids.add(id_1)
+                    processed_ids.add(id_2)
+
+            for id in visited:
+                if id not in processed_ids:
+                    self.update_status(
+                        id=id, state=states[id], interval_end_moment=interval_end_moment)
+
+            for id in visited | self.touched:
+                self.schedule(id, interval+1)
+            self.touched.clear()
+
+        self.instrumentation.count_all(self.instrumentation_prefix, intervals=no_visited,
+                                       contacts_scanned=contacts_scanned)
+        return
+
+    def change_state(self, id, state, moment):
+        # the next visits of id are computed again after the interval
+        self.touched.add(id)
+        super().change_state(id=id, state=state, moment=moment)
+
+    def schedule(self, id, interval):
+        """Queue the next visits of id from interval on: when its status change is due and when it has a contact
+        while exposed or infectious"""
+        state = self.state_buffer[id]
+        due_interval = wake_interval = None
+        if state == EXPOSED or state == INFECTIOUS:
+            due_interval = self.get_due_interval(self.exposed_to_infectious_moment(
+                id) if state == EXPOSED else self.infectious_to_recovered_moment(id), interval)
+            # the first contact of id not ended at interval, contacts are scanned from the interval they start in
+            next_row = bisect_right(self.person_end_intervals, interval,
+                                    self.row_bounds[id], self.row_bounds[id+1])
+            if next_row < self.row_bounds[id+1]:
+                wake_interval = max(
+                    interval, self.first_intervals[self.person_rows[next_row]])
+        elif state == RECOVERED:
+            due_interval = self.get_due_interval(
+                self.recovered_to_susceptible_moment(id), interval)
+
+        for next_interval, next_intervals in ((due_interval, self.due_interval), (wake_interval, self.wake_interval)):
+            if next_interval is None:
+                next_intervals.pop(id, None)
+            elif next_intervals.get(id) != next_interval:
+                next_intervals[id] = next_interval
+                heapq.heappush(self.queue, (next_interval, id))
+
+    def get_due_interval(self, moment, interval) -> int:
+        # the first interval from interval on which ends at or after moment
+        return max(interval, bisect_left(self.moment_view, moment) - 1)
@@ -1,16 +1,34 @@
 from Trajectory_Network import TrajectoryNetwork
-from collections import defaultdict
+from SEIR_History import SEIRHistory, SUSCEPTIBLE, EXPOSED, INFECTIOUS, RECOVERED
+from Observation_Schedule import ObservationSchedule
+from Instrumentation import Instrumentation, Instrumented
 from tqdm import tqdm
 import matplotlib.pyplot as plt
+import numpy as np
 import math
-import random
 
 
-class HeterogeneousSEIR():
-    def __init__(self, trajectory_network: TrajectoryNetwork, s_initial: set, i_initial: set, infect_rate: float, t_incubation: float, t_recovery: float, time_step: float):
+class HeterogeneousSEIR(Instrumented):
+    # the ensemble only keeps counts, without SEIR_population
+    keeps_history = True
+
+    def __init__(self, trajectory_network: TrajectoryNetwork, s_initial: set, i_initial: set, infect_rate: float, t_incubation: float, t_recovery: float, time_step: float, observation_schedule: ObservationSchedule = None, seed=None, instrumentation: Instrumentation = None):
         self.trajectory_network = trajectory_network
-        # SEIR at each time step
-        self.SEIR_population = [[s_initial, set(), i_initial, set()]]
+        # timers and counters of the run, see report
+        self.set_instrumentation(instrumentation)
+
+        # all people's id remapped to dense indices, tags[index] is the original id
+        self.tags = np.array(sorted(s_initial.union(i_initial)))
+        self.tag_to_index = {tag: index for index, tag in enumerate(self.tags.tolist())}
+
+        # status of each person indexed by dense index
+        self.states = np.full(len(self.tags), SUSCEPTIBLE, dtype=np.int8)
+        self.states[[self.tag_to_index[tag] for tag in i_initial]] = INFECTIOUS
+
+        # SEIR at each time step, rebuilt from the transition log
+        if self.keeps_history:
+            self.SEIR_population = SEIRHistory(
+                initial_states=self.states, tags=self.tags)
 
         self.infect_rate = infect_rate
 
@@ -19,13 +37,19 @@ class HeterogeneousSEIR():
         self.t_recovery = math.ceil(t_recovery/time_step)
 
         # incubation period of each person
-        self.incubation_periods = defaultdict(int)
+        self.incubation_periods = np.zeros(len(self.tags), dtype=np.int32)
         # recovery period of each person
-        self.recovery_periods = defaultdict(int)
+        self.recovery_periods = np.zeros(len(self.tags), dtype=np.int32)
 
-        self.ids = s_initial.union(i_initial)
+        # time steps reported by get_num_SEIR, every time step if None
+        self.observation_schedule = observation_schedule
 
-        self.epidemic_spreading()
+        self.rng = np.random.default_rng(seed)
+
+        name = self.instrumentation_prefix
+        self.instrumentation.run(name + ".run", self.epidemic_spreading)
+        if self.keeps_history:
+            self.instrumentation.record_history(name, self.SEIR_population)
 
     def calculate_infect_probability(self, contact_duration: float) -> float:
         """The probability of infection between 2 individuals after contact_duration, given their total_contact_duration_in_the_same_timestep """
@@ -35,54 +59,126 @@ class HeterogeneousSEIR():
 
     def epidemic_spreading(self):
         # see the algorithm in PechlivanogLou et al. 2022
-        graphs = self.trajectory_network.get_trajectory_network()
-
-        for index, graph in enumerate(graphs):
-            S = self.SEIR_population[index][0]
-            E = self.SEIR_population[index][1]
-            I = self.SEIR_population[index][2]
-            R = self.SEIR_population[index][3]
-
-            next_S = S.copy()
-            next_E = E.copy()
-            next_I = I.copy()
-            next_R = R.copy()
-
-            for u in self.ids:
-                if u in S:  # u is suspected
-                    if not u in graph:
-                        continue
-                    for v in graph.neighbors(u):
-                        if v in I:  # v is infected
-                            # v does not infect u
-                            if random.random() > self.calculate_infect_probability(graph[u][v]["weight"]):
-                                continue
-
-                            # incubation period of u begins
-                            self.incubation_periods[u] = 0
-
-                            if u in next_S:
-                                next_S.remove(u)
-                            next_E.add(u)
-                elif u in E:  # u is exposed
-                    self.incubation_periods[u] += 1
-                    if self.incubation_periods[u] == self.t_incubation:
-                        # recovery period of u begins
-                        self.recovery_periods[u] = 0
-                        next_E.remove(u)
-                        next_I.add(u)
-                elif u in I:  # u is infected
-                    self.recovery_periods[u] += 1
-                    if self.recovery_periods[u] == self.t_recovery:
-                        next_I.remove(u)
-                        next_R.add(u)
-                else:
-                    pass
-
-            self.SEIR_population.append([next_S, next_E, next_I, next_R])
+        # each graph is a sparse matrix of the log probabilities of not being infected through each contact,
+        # or an unweighted adjacency matrix with the log probability shared by all its contacts
+        graphs = self.trajectory_network.get_log_escape_kernels(
+            self.tags, self.infect_rate)
+        # graphs may be a generator of a streaming network
+        no_timesteps = self.trajectory_network.get_no_timesteps()
+
+        if self.observation_schedule is None:
+            self.SEIR_population.time_points = list(range(no_timesteps+1))
+        else:
+            self.SEIR_population.time_points = self.observation_schedule.get_times(
+                end=no_timesteps).tolist()
+
+        # only exposed and infectious people and the susceptible people next to an infectious one can change
+        exposed = np.flatnonzero(self.states == EXPOSED)
+        infectious = np.flatnonzero(self.states == INFECTIOUS)
+
+        timer = self.instrumentation.lap_timer(self.instrumentation_prefix)
+        no_timesteps_visited = contacts_scanned = susceptible_exposed = 0
+        timer.start()
+
+        for index, (graph, edge_log_escape) in enumerate(graphs):
+            # time spent building or reading the graph of the timestep
+            timer.lap("kernels")
+            no_timesteps_visited += 1
+
+            # nothing changes anymore, the counts of the remaining time steps stay the same
+            if len(exposed) == 0 and len(infectious) == 0:
+                break
+
+            # the susceptible people next to an infectious one, and the log probability that they escape all of them
+            contacts = graph[infectious]
+            neighbors, neighbor_index = np.unique(
+                contacts.indices, return_inverse=True)
+            if edge_log_escape is None:
+                log_escape = np.bincount(
+                    neighbor_index, weights=contacts.data, minlength=len(neighbors))
+            else:
+                # the same probability for every contact, only the number of infectious neighbors matters
+                log_escape = edge_log_escape * \
+                    np.bincount(neighbor_index, minlength=len(neighbors))
+            frontier = self.states[neighbors] == SUSCEPTIBLE
+            neighbors, log_escape = neighbors[frontier], log_escape[frontier]
+
+            # u is infected unless it escapes every infected neighbor v
+            newly_exposed = neighbors[self.rng.random(
+                len(neighbors)) < 1 - np.exp(log_escape)]
+
+            timer.lap("infection")
+            # contacts of the infectious people, and the susceptible people they can infect
+            contacts_scanned += contacts.nnz
+            susceptible_exposed += len(neighbors)
+
+            self.incubation_periods[exposed] += 1
+            incubated = self.incubation_periods[exposed] == self.t_incubation
+            newly_infectious = exposed[incubated]
+
+            self.recovery_periods[infectious] += 1
+            recovered = self.recovery_periods[infectious] == self.t_recovery
+            newly_recovered = infectious[recovered]
+
+            # incubation period of u begins
+            self.incubation_periods[newly_exposed] = 0
+            # recovery period of u begins
+            self.recovery_periods[newly_infectious] = 0
+
+            for ids, from_state, to_state in ((newly_exposed, SUSCEPTIBLE, EXPOSED), (newly_infectious, EXPOSED, INFECTIOUS), (newly_recovered, INFECTIOUS, RECOVERED)):
+                self.states[ids] = to_state
+                self.SEIR_population.record_many(time=index+1, ids=ids, from_states=np.full(
+                    len(ids), from_state), to_states=np.full(len(ids), to_state))
+
+            exposed = np.concatenate([exposed[~incubated], newly_exposed])
+            infectious = np.concatenate(
+                [infectious[~recovered], newly_infectious])
+            timer.lap("progression")
+
+        timer.stop()
+        self.instrumentation.count_all(self.instrumentation_prefix, timesteps=no_timesteps_visited,
+                                       contacts_scanned=contacts_scanned, susceptible_exposed=susceptible_exposed)
         return
 
+    def advance(self, log_escape_graph, states: np.ndarray, incubation_periods: np.ndarray, recovery_periods: np.ndarray, edge_log_escape: float = None) -> np.ndarray:
+        """States after one time step, states and periods are people or replicas x people arrays, periods are updated in place.
+
+        When edge_log_escape is given, log_escape_graph is an adjacency matrix and every contact has this log escape probability"""
+        susceptible = states == SUSCEPTIBLE
+        exposed = states == EXPOSED
+        infectious = states == INFECTIOUS
+
+        # u is infected unless it escapes every infected neighbor v
+        log_escape = (log_escape_graph @ infectious.reshape(-1,
+                      states.shape[-1]).T.astype(np.float64)).T.reshape(states.shape)
+        if edge_log_escape is not None:
+            log_escape *= edge_log_escape
+        newly_exposed = susceptible & (self.rng.random(
+            states.shape) < 1 - np.exp(log_escape))
+
+        # incubation period of u begins
+        incubation_periods[newly_exposed] = 0
+
+        incubation_periods[exposed] += 1
+        # recovery period of u begins
+        newly_infectious = exposed & (incubation_periods == self.t_incubation)
+        recovery_periods[newly_infectious] = 0
+
+        recovery_periods[infectious] += 1
+        newly_recovered = infectious & (recovery_periods == self.t_recovery)
+
+        next_states = states.copy()
+        next_states[newly_exposed] = EXPOSED
+        next_states[newly_infectious] = INFECTIOUS
+        next_states[newly_recovered] = RECOVERED
+        return next_states
+
     def get_num_SEIR(self):
         # dim: days x 4
         # the number people of each group S, E, I , R over time
-        return [[len(s) for s in SEIR_t] for SEIR_t in self.SEIR_population]
+        return self.SEIR_population.get_num_SEIR()
+
+    def get_num_SEIR_at(self, times) -> np.ndarray:
+        # dim: len(times) x 4
+        # the number people of each group S, E, I , R at any time steps
+        return self.SEIR_population.counts_at(times)
@@ -0,0 +1,74 @@
+from Heterogeneous_SEIR import HeterogeneousSEIR
+from Trajectory_Network import TrajectoryNetwork
+from SEIR_History import SUSCEPTIBLE, EXPOSED, INFECTIOUS, RECOVERED
+from Observation_Schedule import ObservationSchedule
+from Instrumentation import Instrumentation
+import numpy as np
+
+
+class HeterogeneousSEIREnsemble(HeterogeneousSEIR):
+    """no_replicas realisations of HeterogeneousSEIR on the same trajectory network advanced together.
+
+    The states are kept in a replicas x people matrix, and each day the log escape matrix of the graph is
+    multiplied with the people x replicas infectious indicator matrix. The edge probabilities are computed
+    once per graph by the trajectory network.
+
+    get_num_SEIR returns a replicas x time steps x 4 array. The replicas keep no transition log, so there is no
+    SEIR_population."""
+
+    keeps_history = False
+
+    def __init__(self, trajectory_network: TrajectoryNetwork, s_initial: set, i_initial: set, infect_rate: float, t_incubation: float, t_recovery: float, time_step: float, no_replicas: int, observation_schedule: ObservationSchedule = None, seed=None, instrumentation: Instrumentation = None):
+        self.no_replicas = no_replicas
+        super().__init__(trajectory_network=trajectory_network, s_initial=s_initial, i_initial=i_initial, infect_rate=infect_rate,
+                         t_incubation=t_incubation, t_recovery=t_recovery, time_step=time_step, observation_schedule=observation_schedule, seed=seed,
+                         instrumentation=instrumentation)
+
+    def epidemic_spreading(self):
+        graphs = self.trajectory_network.get_log_escape_kernels(
+            self.tags, self.infect_rate)
+        # graphs may be a generator of a streaming network
+        no_timesteps = self.trajectory_network.get_no_timesteps()
+
+        # dim: replicas x people
+        states = np.tile(self.states, (self.no_replicas, 1))
+        incubation_periods = np.zeros(states.shape, dtype=np.int32)
+        recovery_periods = np.zeros(states.shape, dtype=np.int32)
+
+        # dim: replicas x time steps x 4
+        num_SEIR = np.zeros(
+            (self.no_replicas, no_timesteps+1, 4), dtype=np.int64)
+        num_SEIR[:, 0] = self.count_SEIR(states)
+        for index, (graph, edge_log_escape) in enumerate(graphs):
+            # nothing changes anymore in any replica, the remaining time steps keep the same counts
+            if not ((states == EXPOSED) | (states == INFECTIOUS)).any():
+                num_SEIR[:, index+1:] = num_SEIR[:, index:index+1]
+                break
+
+            states = self.advance(
+                graph, states, incubation_periods, recovery_periods, edge_log_escape)
+            num_SEIR[:, index+1] = self.count_SEIR(states)
+
+        if self.observation_schedule is None:
+            self.time_points = np.arange(no_timesteps+1)
+        else:
+            self.time_points = self.observation_schedule.get_times(
+                end=no_timesteps).astype(np.int64)
+        # time steps after the last graph keep the last counts
+        self.num_SEIR = num_SEIR[:, np.minimum(self.time_points, no_timesteps)]
+        return
+
+    def count_SEIR(self, states: np.ndarray) -> np.ndarray:
+        """Number of people in S, E, I, R in each replica, dim: replicas x 4"""
+        return np.stack([(states == state).sum(axis=1) for state in (SUSCEPTIBLE, EXPOSED, INFECTIOUS, RECOVERED)], axis=1)
+
+    def get_num_SEIR(self) -> np.ndarray:
+        # dim: replicas x time steps x 4
+        # the number people of each group S, E, I , R over time in each replica
+        return self.num_SEIR
+
+    def get_num_SEIR_at(self, times) -> np.ndarray:
+        # dim: replicas x len(times) x 4
+        # the counts of the last time point at or before each of times, the first time point before it
+        index = np.searchsorted(self.time_points, times, side='right') - 1
+        return self.num_SEIR[:, np.maximum(index, 0)]
@@ -1,32 +1,17 @@
 from Trajectory_Network import TrajectoryNetwork
+from Array_Cache import ArrayCache
+from Instrumentation import Instrumentation
 from typing import List
-from tqdm import tqdm
-import networkx as nx
 import pandas as pd
+import numpy as np
 
 
 class HeterogeneousTrajectoryNetwork(TrajectoryNetwork):
-    def __init__(self, list_of_dfs: List[pd.DataFrame]):
-        super().__init__(list_of_dfs)
+    def __init__(self, list_of_dfs: List[pd.DataFrame], use_networkx: bool = True, cache: ArrayCache = None, tags: np.ndarray = None, instrumentation: Instrumentation = None):
+        super().__init__(list_of_dfs, use_networkx=use_networkx,
+                         cache=cache, tags=tags, instrumentation=instrumentation)
         self.build_network()
 
-    def build_network(self):
-        self.graphs = [self.build_graph(df) for df in tqdm(self.list_of_dfs, desc="Building Trajectory Network")]
-        return
-
-    def build_graph(self, df: pd.DataFrame) -> nx.Graph:
-        G = nx.Graph()
-        for _, row in df.iterrows():
-            if not G.has_node(row['id_1']):
-                G.add_node(row['id_1'])
-            if not G.has_node(row['id_2']):
-                G.add_node(row['id_2'])
-            if row['id_1'] != row['id_2']:
-                # The link between 2 individuals in the graph is their contact duration in the whole df
-                # see Stehlé et al. BMC Medicine 2011
-                if G.has_edge(row['id_1'], row['id_2']):
-                    G[row['id_1']][row['id_2']]['weight'] += row['contact_duration']
-                else:
-                    G.add_edge(row['id_1'], row['id_2'],
-                               weight=row['contact_duration'])
-        return G
+    # The link between 2 individuals in the graph is their contact duration in the whole df
+    # see Stehlé et al. BMC Medicine 2011
+    # (TrajectoryNetwork.get_edge_weights)
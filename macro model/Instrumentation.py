@@ -0,0 +1,237 @@
+from collections import defaultdict
+from contextlib import nullcontext
+from typing import Callable
+import cProfile
+import io
+import pstats
+import time
+import tracemalloc
+import numpy as np
+
+PROFILERS = (None, "cprofile", "tracemalloc")
+
+# returned by phase when disabled, so an instrumented block costs one call
+DISABLED_PHASE = nullcontext()
+
+
+class Phase():
+    """Context manager adding the wall-clock time of a block to a timer of an Instrumentation"""
+
+    def __init__(self, timers: dict, name: str):
+        self.timers = timers
+        self.name = name
+        self.start = 0.0
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.timers[self.name] += time.perf_counter() - self.start
+        return False
+
+
+class LapTimer():
+    """Times consecutive phases of a loop, each lap adds the time since the previous lap to its phase.
+
+    The seconds are summed locally and added to the Instrumentation by stop, so a lap costs one perf_counter."""
+
+    def __init__(self, instrumentation, prefix: str):
+        self.instrumentation = instrumentation
+        self.prefix = prefix
+        self.seconds = defaultdict(float)
+        self.calls = defaultdict(int)
+        self.last = 0.0
+
+    def start(self):
+        self.last = time.perf_counter()
+
+    def lap(self, phase: str):
+        now = time.perf_counter()
+        self.seconds[phase] += now - self.last
+        self.calls[phase] += 1
+        self.last = now
+
+    def stop(self):
+        for phase, seconds in self.seconds.items():
+            self.instrumentation.add_time(
+                self.prefix + "." + phase, seconds, self.calls[phase])
+        self.seconds.clear()
+        self.calls.clear()
+
+
+class DisabledLapTimer():
+    """LapTimer of a disabled Instrumentation, every method does nothing"""
+
+    def start(self):
+        pass
+
+    def lap(self, phase: str):
+        pass
+
+    def stop(self):
+        pass
+
+
+DISABLED_TIMER = DisabledLapTimer()
+
+
+class Instrumentation():
+    """Per-phase timers, counters and values collected by the SEIR models and network builders.
+
+    Disabled instances do nothing, and their lap_timer returns a timer doing nothing, so a disabled run keeps its speed.
+    profile wraps each run in cProfile or tracemalloc ("cprofile" or "tracemalloc"). One instance can be passed to
+    several models, the names of their phases and counters start with the name of the model."""
+
+    def __init__(self, enabled: bool = True, profile: str = None, top: int = 20):
+        if profile not in PROFILERS:
+            raise ValueError("profile must be one of {}".format(PROFILERS))
+        self.enabled = enabled
+        self.profile = profile if enabled else None
+        # number of functions or allocation sites kept in the profile report
+        self.top = top
+
+        # seconds spent in each phase and number of times it was entered
+        self.timers = defaultdict(float)
+        self.calls = defaultdict(int)
+        # summed counts, such as contacts scanned
+        self.counters = defaultdict(int)
+        # last value of measures which do not add up, such as bytes held
+        self.values = {}
+        # profile report of each run
+        self.profiles = {}
+
+    def phase(self, name: str):
+        """Context manager timing a block as phase name"""
+        if not self.enabled:
+            return DISABLED_PHASE
+        self.calls[name] += 1
+        return Phase(self.timers, name)
+
+    def add_time(self, name: str, seconds: float, calls: int = 1):
+        """Time of a phase measured by the caller, for hot loops timing with local variables"""
+        if self.enabled:
+            self.timers[name] += seconds
+            self.calls[name] += calls
+
+    def lap_timer(self, prefix: str):
+        """LapTimer of the phases prefix.<phase>, a timer doing nothing when disabled"""
+        if not self.enabled:
+            return DISABLED_TIMER
+        return LapTimer(self, prefix)
+
+    def count(self, name: str, value: int = 1):
+        if self.enabled:
+            self.counters[name] += value
+
+    def count_all(self, prefix: str, **counts):
+        """Add each count as counter prefix.<name>"""
+        if self.enabled:
+            for name, value in counts.items():
+                self.counters[prefix + "." + name] += value
+
+    def set(self, name: str, value):
+        if self.enabled:
+            self.values[name] = value
+
+    def counted(self, name: str, function: Callable) -> Callable:
+        """function counting its calls as counter name, function itself when disabled"""
+        if not self.enabled:
+            return function
+        counters = self.counters
+
+        def counted_function(*args, **kwargs):
+            counters[name] += 1
+            return function(*args, **kwargs)
+        return counted_function
+
+    def count_transitions(self, prefix: str, from_states: np.ndarray, to_states: np.ndarray):
+        """Count the transitions of a SEIR log by type, as prefix.transitions.S->E and so on"""
+        if not self.enabled:
+            return
+        types, counts = np.unique(4*np.asarray(from_states, dtype=np.int64) +
+                                  np.asarray(to_states, dtype=np.int64), return_counts=True)
+        for transition_type, count in zip(types.tolist(), counts.tolist()):
+            self.count("{}.transitions.{}->{}".format(prefix,
+                       "SEIR"[transition_type//4], "SEIR"[transition_type % 4]), count)
+
+    def record_history(self, prefix: str, history):
+        """Bytes held by a SEIRHistory and the number of its transitions of each type"""
+        if not self.enabled:
+            return
+        self.set(prefix + ".SEIR_population_bytes", history.nbytes())
+        self.count_transitions(prefix, history.from_states, history.to_states)
+
+    def run(self, name: str, function: Callable, *args, **kwargs):
+        """function(*args, **kwargs) timed as phase name, under the profiler when profile is set"""
+        if not self.enabled:
+            return function(*args, **kwargs)
+
+        with self.phase(name):
+            if self.profile == "cprofile":
+                profiler = cProfile.Profile()
+                try:
+                    return profiler.runcall(function, *args, **kwargs)
+                finally:
+                    self.profiles[name] = self.get_cprofile_report(profiler)
+            if self.profile == "tracemalloc":
+                return self.run_tracemalloc(name, function, *args, **kwargs)
+            return function(*args, **kwargs)
+
+    def run_tracemalloc(self, name: str, function: Callable, *args, **kwargs):
+        # a run nested in a traced run keeps the outer tracing going
+        was_tracing = tracemalloc.is_tracing()
+        if not was_tracing:
+            tracemalloc.start()
+        tracemalloc.reset_peak()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            current_bytes, peak_bytes = tracemalloc.get_traced_memory()
+            statistics = tracemalloc.take_snapshot().statistics("lineno")[:self.top]
+            if not was_tracing:
+                tracemalloc.stop()
+            self.profiles[name] = {"current_bytes": current_bytes, "peak_bytes": peak_bytes,
+                                   "top": [{"location": str(statistic.traceback), "bytes": statistic.size, "count": statistic.count}
+                                           for statistic in statistics]}
+
+    def get_cprofile_report(self, profiler: cProfile.Profile) -> dict:
+        """The functions with the largest cumulative time, and the printed pstats table"""
+        stream = io.StringIO()
+        stats = pstats.Stats(profiler, stream=stream).sort_stats("cumulative")
+        stats.print_stats(self.top)
+        functions = sorted(stats.stats.items(), key=lambda item: item[1][3], reverse=True)[:self.top]
+        return {"total_seconds": stats.total_tt,
+                "top": [{"function": "{}:{}({})".format(*location), "calls": no_calls, "total_seconds": total_time,
+                         "cumulative_seconds": cumulative_time}
+                        for location, (_, no_calls, total_time, cumulative_time, _) in functions],
+                "table": stream.getvalue()}
+
+    def report(self) -> dict:
+        """Timers, counters, values and profiles as plain dicts, ready for json"""
+        return {"timers": {name: {"seconds": seconds, "calls": self.calls[name]} for name, seconds in self.timers.items()},
+                "counters": dict(self.counters),
+                "values": dict(self.values),
+                "profiles": dict(self.profiles)}
+
+    def reset(self):
+        self.timers.clear()
+        self.calls.clear()
+        self.counters.clear()
+        self.values.clear()
+        self.profiles.clear()
+
+
+class Instrumented():
+    """Mixin of the models and network builders which take an optional Instrumentation"""
+
+    def set_instrumentation(self, instrumentation: Instrumentation = None):
+        # a disabled instance when none is given, so the code never checks for None
+        self.instrumentation = Instrumentation(
+            enabled=False) if instrumentation is None else instrumentation
+        # timers and counters of this object start with the name of its class
+        self.instrumentation_prefix = type(self).__name__
+
+    def report(self) -> dict:
+        """Timers, counters and profiles collected so far, empty unless an enabled Instrumentation was given"""
+        return self.instrumentation.report()
@@ -0,0 +1,39 @@
+from typing import List
+import numpy as np
+
+
+class ObservationSchedule():
+    """The times at which a SEIR model reports S, E, I, R counts.
+
+    Either explicit times, or offsets repeated every period: offset + i*period for i in range(no_periods).
+    When no_periods is not given, the periods are repeated until the end of the simulation."""
+
+    def __init__(self, times: List[float] = None, period: float = None, offsets: List[float] = (0,), no_periods: int = None, include_initial: bool = True):
+        if times is None and period is None:
+            raise ValueError("either times or period must be given")
+
+        self.times = None if times is None else np.sort(
+            np.asarray(times, dtype=np.float64))
+        self.period = period
+        self.offsets = np.sort(np.asarray(offsets, dtype=np.float64))
+        self.no_periods = no_periods
+        # report the initial population at time 0
+        self.include_initial = include_initial
+
+    def get_times(self, end: float = None) -> np.ndarray:
+        """Sorted observation times, periods are repeated until end when no_periods is not given"""
+        if self.times is not None:
+            times = self.times
+        else:
+            no_periods = self.no_periods
+            if no_periods is None:
+                no_periods = 0 if end is None else int(
+                    np.floor((end-self.offsets[0])/self.period))+1
+            times = (np.arange(no_periods)[:, None]*self.period +
+                     self.offsets[None, :]).ravel()
+            if self.no_periods is None and end is not None:
+                times = times[times <= end]
+
+        if self.include_initial and (len(times) == 0 or times[0] != 0):
+            times = np.concatenate([[0], times])
+        return times
@@ -0,0 +1,119 @@
+from array import array
+import numpy as np
+
+# status of a person, stored as int8 (-1 for people outside the population)
+SUSCEPTIBLE = 0
+EXPOSED = 1
+INFECTIOUS = 2
+RECOVERED = 3
+
+
+class SEIRHistory():
+    """SEIR population over time, kept as the initial status of each person plus an append-only log of
+    transitions (time, id, from_state, to_state). S, E, I, R sets are only rebuilt when a time is asked for."""
+
+    def __init__(self, initial_states: np.ndarray, tags: np.ndarray, time_points: list = None):
+        self.initial_states = np.array(initial_states, dtype=np.int8)
+        # tags[id] is the original id of the person with dense index id
+        self.tags = tags
+        # the times reported by get_num_SEIR
+        self.time_points = [0] if time_points is None else time_points
+
+        # transition log
+        self.times = array('d')
+        self.ids = array('i')
+        self.from_states = array('b')
+        self.to_states = array('b')
+
+        # number of people in S, E, I, R after the last transition
+        self.counts = self.count_states(self.initial_states)
+
+        # transition log sorted by time and the S, E, I, R counts after each transition
+        self.sorted_log = None
+        self.cumulative_counts = None
+
+    def record(self, time: float, id: int, from_state: int, to_state: int):
+        self.times.append(time)
+        self.ids.append(id)
+        self.from_states.append(from_state)
+        self.to_states.append(to_state)
+
+        self.counts[from_state] -= 1
+        self.counts[to_state] += 1
+        self.sorted_log = None
+
+    def record_many(self, time: float, ids: np.ndarray, from_states: np.ndarray, to_states: np.ndarray):
+        """Record transitions of several people happening at the same time"""
+        self.times.extend([time]*len(ids))
+        self.ids.extend(np.asarray(ids, dtype=np.int32).tolist())
+        self.from_states.extend(np.asarray(from_states, dtype=np.int8).tolist())
+        self.to_states.extend(np.asarray(to_states, dtype=np.int8).tolist())
+
+        self.counts -= np.bincount(from_states, minlength=4)
+        self.counts += np.bincount(to_states, minlength=4)
+        self.sorted_log = None
+
+    def count_states(self, states: np.ndarray) -> np.ndarray:
+        return np.bincount(states[states >= 0], minlength=4)
+
+    def get_log(self):
+        """times, ids, from_states, to_states of all transitions, sorted by time"""
+        if self.sorted_log is None:
+            times = np.frombuffer(self.times, dtype=np.float64)
+            order = np.argsort(times, kind='stable')
+            from_states = np.frombuffer(self.from_states, dtype=np.int8)[order]
+            to_states = np.frombuffer(self.to_states, dtype=np.int8)[order]
+            self.sorted_log = (times[order], np.frombuffer(
+                self.ids, dtype=np.int32)[order], from_states, to_states)
+
+            # S, E, I, R counts before the first transition and after each transition
+            deltas = np.zeros((len(order)+1, 4), dtype=np.int64)
+            deltas[0] = self.count_states(self.initial_states)
+            np.subtract.at(deltas, (np.arange(1, len(order)+1), from_states), 1)
+            np.add.at(deltas, (np.arange(1, len(order)+1), to_states), 1)
+            self.cumulative_counts = np.cumsum(deltas, axis=0)
+        return self.sorted_log
+
+    def states_at(self, time: float) -> np.ndarray:
+        """Status of each person after all transitions happening until time"""
+        times, ids, _, to_states = self.get_log()
+        no_transitions = np.searchsorted(times, time, side='right')
+
+        states = self.initial_states.copy()
+        # the last transition of each person decides its status
+        last_ids, reversed_index = np.unique(
+            ids[:no_transitions][::-1], return_index=True)
+        states[last_ids] = to_states[no_transitions-1-reversed_index]
+        return states
+
+    def counts_at(self, times) -> np.ndarray:
+        """Number of people in S, E, I, R at each of times, dim: len(times) x 4"""
+        log_times = self.get_log()[0]
+        return self.cumulative_counts[np.searchsorted(log_times, times, side='right')]
+
+    def get_num_SEIR(self):
+        # dim: time points x 4
+        return self.counts_at(self.time_points).tolist()
+
+    def nbytes(self) -> int:
+        """Memory held by the initial status and the transition log"""
+        log_nbytes = sum(log.itemsize*len(log) for log in (self.times,
+                         self.ids, self.from_states, self.to_states))
+        return self.initial_states.nbytes + log_nbytes
+
+    def __getitem__(self, time) -> list:
+        """S, E, I, R populations (original ids) at time"""
+        states = self.states_at(time)
+        return [set(self.tags[states == state].tolist()) for state in (SUSCEPTIBLE, EXPOSED, INFECTIOUS, RECOVERED)]
+
+    def __len__(self):
+        return len(self.time_points)
+
+    def __iter__(self):
+        return iter(self.time_points)
+
+    def keys(self):
+        return list(self.time_points)
+
+    def items(self):
+        return [(time, self[time]) for time in self.time_points]
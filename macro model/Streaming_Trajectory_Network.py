@@ -0,0 +1,153 @@
+from Trajectory_Network import TrajectoryNetwork
+from Instrumentation import Instrumentation
+from collections import OrderedDict
+from typing import Iterable, Iterator
+import networkx as nx
+import numpy as np
+import pandas as pd
+
+
+class StreamingTrajectoryNetwork(TrajectoryNetwork):
+    """TrajectoryNetwork whose timesteps are read on demand instead of being built and kept in memory.
+
+    days is a sequence of dfs or of paths to them (.pkl, .parquet or .csv), which can be read again, or a one-shot
+    iterator of dfs, which needs no_days and can only be traversed once. Only the edges of the last cache_size timesteps
+    are kept, so get_trajectory_network and get_log_escape_kernels are generators.
+
+    The links are the contact durations of the timestep, or their mean when homogeneous (as in
+    HeterogeneousTrajectoryNetwork and HomogeneousTrajectoryNetwork)."""
+
+    def __init__(self, days: Iterable, no_days: int = None, homogeneous: bool = False, ids: np.ndarray = None, use_networkx: bool = True, cache_size: int = 2, tags: np.ndarray = None, instrumentation: Instrumentation = None):
+        super().__init__([], use_networkx=use_networkx,
+                         tags=tags, instrumentation=instrumentation)
+        self.uniform_weights = homogeneous
+
+        if isinstance(days, Iterator):
+            if no_days is None:
+                raise ValueError("no_days must be given for an iterator of dfs")
+            self.day_iterator = days
+            self.day_sequence = None
+        else:
+            self.day_iterator = None
+            self.day_sequence = days
+            no_days = len(days) if no_days is None else no_days
+        self.no_days = no_days
+        # index of the next df of day_iterator
+        self.next_day = 0
+
+        # individuals of the sparse matrices of get_trajectory_network without networkx, all of them must be known upfront
+        self.ids = np.array([], dtype=np.int64) if ids is None else np.unique(ids)
+
+        # timestep -> (nodes, (id_1, id_2, weight), contact durations) of the recently used timesteps
+        self.cache_size = cache_size
+        self.recent_days = OrderedDict()
+
+    def get_no_timesteps(self) -> int:
+        return self.no_days
+
+    def load_day(self, day: int) -> pd.DataFrame:
+        df = self.day_sequence[day]
+        if not isinstance(df, str):
+            return df
+        if df.endswith('.pkl'):
+            return pd.read_pickle(df)
+        if df.endswith('.parquet'):
+            return pd.read_parquet(df)
+        return pd.read_csv(df)
+
+    def get_day(self, day: int):
+        """nodes, (id_1, id_2, weight) edges and contact durations of a timestep"""
+        if day in self.recent_days:
+            self.recent_days.move_to_end(day)
+            return self.recent_days[day]
+
+        if self.day_iterator is None:
+            self.remember(day, self.compile_day(self.load_day(day)))
+        else:
+            if day < self.next_day:
+                raise ValueError(
+                    "timestep {} of the iterator of dfs was already consumed".format(day))
+            while self.next_day <= day:
+                df = next(self.day_iterator, None)
+                if df is None:
+                    raise ValueError("the iterator of dfs ended after {} timesteps, {} were expected".format(
+                        self.next_day, self.no_days))
+                self.remember(self.next_day, self.compile_day(df))
+                self.next_day += 1
+        return self.recent_days[day]
+
+    def remember(self, day: int, compiled_day):
+        self.recent_days[day] = compiled_day
+        while len(self.recent_days) > self.cache_size:
+            self.recent_days.popitem(last=False)
+
+    def compile_day(self, df: pd.DataFrame):
+        name = self.instrumentation_prefix
+        self.instrumentation.count(name + ".contacts", len(df))
+        with self.instrumentation.phase(name + ".compile_day"):
+            return self.compile_timestep(df)
+
+    def compile_timestep(self, df: pd.DataFrame):
+        _, id_1, id_2, durations = self.aggregate_contacts([df])
+        _, nodes = self.get_nodes([df])
+        return nodes, (id_1, id_2, self.get_edge_weights(durations)), pd.DataFrame({"id_1": id_1, "id_2": id_2, "contact_duration": durations})
+
+    def get_trajectory_network(self):
+        """Generator of the nx.Graph of each timestep, or of their sparse matrices over ids without networkx"""
+        for day in range(self.no_days):
+            nodes, edges, _ = self.get_day(day)
+            if self.use_networkx:
+                yield nx.freeze(self.to_graph(nodes, edges))
+            elif len(self.ids) == 0:
+                raise ValueError(
+                    "ids must be given to stream sparse matrices without networkx")
+            else:
+                yield self.edges_to_sparse(edges, self.ids)
+
+    def get_sparse_trajectory_network(self, ids: np.ndarray):
+        for day in range(self.no_days):
+            yield self.edges_to_sparse(self.get_day(day)[1], ids)
+
+    def get_log_escape_trajectory_network(self, ids: np.ndarray, infect_rate: float):
+        for graph in self.get_sparse_trajectory_network(ids):
+            yield self.calculate_log_escape(graph, infect_rate)
+
+    def get_log_escape_kernels(self, ids: np.ndarray, infect_rate: float):
+        """Generator of (graph, edge_log_escape) of each timestep, see TrajectoryNetwork.get_log_escape_kernels"""
+        for day in range(self.no_days):
+            id_1, id_2, weights = self.get_day(day)[1]
+            if not self.uniform_weights:
+                yield self.calculate_log_escape(self.edges_to_sparse((id_1, id_2, weights), ids), infect_rate), None
+            else:
+                day_weight = weights[0] if len(weights) > 0 else 0.0
+                yield self.edges_to_sparse((id_1, id_2, np.ones(len(id_1), dtype=np.int8)), ids), \
+                    self.calculate_log_escape_probability(infect_rate*day_weight)
+
+    def calculate_contact_durations(self):
+        """contact durations for all pairs of individuals, summed in one pass over the timesteps"""
+        totals = pd.DataFrame(
+            {"id_1": [], "id_2": [], "contact_duration": []}).astype(np.int64)
+        # durations of the last timesteps, added to totals once they have as many rows,
+        # so each row is summed a bounded number of times on average and memory stays within twice totals
+        pending, no_pending = [], 0
+        # the individuals seen in the timesteps when ids were not given
+        ids = self.ids
+        for day in range(self.no_days):
+            nodes, _, durations = self.get_day(day)
+            pending.append(durations)
+            no_pending += len(durations)
+            if no_pending >= len(totals):
+                totals = self.sum_durations([totals] + pending)
+                pending, no_pending = [], 0
+            if len(self.ids) == 0:
+                ids = np.union1d(ids, nodes)
+        totals = self.sum_durations([totals] + pending)
+
+        self.ids = ids
+        self.contact_durations = self.edges_to_sparse(
+            (totals["id_1"].to_numpy(), totals["id_2"].to_numpy(), totals["contact_duration"].to_numpy()), self.ids)
+        return
+
+    def sum_durations(self, frames) -> pd.DataFrame:
+        """contact duration of each pair of individuals summed over frames"""
+        return pd.concat(frames).groupby(["id_1", "id_2"], sort=True)["contact_duration"].sum().reset_index()
@@ -1,85 +1,490 @@
-from collections import defaultdict
-from typing import List
+from typing import Dict, List
+from Array_Cache import ArrayCache
+from Instrumentation import Instrumentation, Instrumented
+import hashlib
+from scipy import sparse
+from tqdm import tqdm
 import networkx as nx
+import numpy as np
 import pandas as pd
 
 
-class TrajectoryNetwork():
-    def __init__(self, list_of_dfs: List[pd.DataFrame]):
+class TrajectoryNetwork(Instrumented):
+    # all edges of a timestep have the same weight, stored once per timestep (see get_day_weight)
+    uniform_weights = False
+
+    def __init__(self, list_of_dfs: List[pd.DataFrame], use_networkx: bool = True, cache: ArrayCache = None, tags: np.ndarray = None, instrumentation: Instrumentation = None):
         # df must have these columns: "id_1", "id_2", "contact_duration"
         # "contact_duration" is the duration of a contact between "id_1" and "id_2"
         self.list_of_dfs = list_of_dfs
+        # when given, "id_1" and "id_2" are dense codes (as in a coded ContactStore) and tags[code] is the individual,
+        # tags must be sorted so the codes and the individuals are in the same order
+        self.tags = tags
+
+        # build nx.Graph objects, otherwise the network only holds edge arrays and sparse matrices
+        self.use_networkx = use_networkx
+        # the built edges are stored in and loaded from cache when given
+        self.cache = cache
+        # timers and counters of the build, see report
+        self.set_instrumentation(instrumentation)
+
+        # all individuals in the network, sorted
+        self.ids = np.array([], dtype=np.int64)
+        # individuals and (id_1, id_2, weight) edge arrays of each distinct timestep
+        self.unique_nodes = []
+        self.unique_edges = []
+        # the weight of every edge of each timestep when uniform_weights, otherwise None
+        self.day_weights = None
+        # index of the distinct timestep of each timestep, identical timesteps share their arrays and graph
+        self.graph_index = []
+        # individuals and edge arrays of each timestep (references to the distinct ones)
+        self.nodes = []
+        self.edges = []
 
         # a sequence of graphs, each graph represents contacts in a timestep
+        # identical timesteps share one frozen graph
         self.graphs = []
+        self.unique_graphs = []
+        # the graphs compiled to sparse matrices for a given order of ids
+        self.sparse_graphs = {}
+        # log escape probabilities of the sparse graphs for a given order of ids and infect rate
+        self.log_escape_graphs = {}
 
-        self.risk_1s = {}  # risk1 of individuals
-        self.risk_2s = {}  # risk2 of individuals
-        self.risk_3s = {}  # risk3 of individuals
+        # risks of self.ids, see PechlivanogLou et al. 2022
+        self.risk_1s = np.array([], dtype=np.int64)  # risk1 of individuals
+        self.risk_2s = np.array([], dtype=np.float64)  # risk2 of individuals
+        self.risk_3s = np.array([], dtype=np.float64)  # risk3 of individuals
         self.sum_risk_1s = 0
         self.sum_risk_2s = 0
         self.sum_risk_3s = 0
 
-        # contact duration of i and j
-        self.contact_durations = defaultdict(lambda: defaultdict(int))
+        # contact duration of i and j in all timesteps, symmetric sparse matrix over self.ids
+        self.contact_durations = sparse.csr_array((0, 0))
 
-        # self.calculate_contact_durations()
-        # self.calculate_risk_1()
-        # self.calculate_risk_2()
-        # self.calculate_risk_3()
+    def calculate_risks(self, infect_rate: float = None):
+        """risk_1 and risk_2 of all individuals, and risk_3 when infect_rate is given"""
+        self.calculate_contact_durations()
+        self.calculate_risk_1()
+        self.calculate_risk_2()
+        if infect_rate is not None:
+            self.calculate_risk_3(infect_rate)
+        return
 
     def calculate_contact_durations(self):
         """contact durations for all pairs of individuals"""
-        for df in self.list_of_dfs:
-            for idx, row in df.iterrows():
-                if row["id_1"] != row["id_2"]:
-                    self.contact_durations[row["id_1"]
-                                           ][row["id_2"]] += row["contact_duration"]
-                    self.contact_durations[row["id_2"]
-                                           ][row["id_1"]] += row["contact_duration"]
+        self.contact_durations = self.get_contact_durations(self.ids)
         return
 
+    def get_contact_durations(self, ids: np.ndarray) -> sparse.csr_array:
+        """The contact durations of all timesteps summed, row/column i is ids[i]"""
+        frame = self.concat_dfs(self.list_of_dfs)
+        # all timesteps summed as a single one
+        frame["day"] = 0
+        _, id_1, id_2, durations = self.aggregate_contacts([frame])
+        return self.edges_to_sparse((id_1, id_2, durations), ids)
+
     def calculate_risk_1(self):
         """The total number of contact for each individual in the temporal network"""
         # see Eq.(1) in PechlivanogLou et al. 2022
-        for id, inner_dict in self.contact_durations.items():
-            self.risk_1s[id] = len(inner_dict)
-            self.sum_risk_1s += self.risk_1s[id]
+        self.risk_1s = np.diff(self.contact_durations.indptr)
+        self.sum_risk_1s = self.risk_1s.sum()
         return
 
     def calculate_risk_2(self):
         """The total duration of contacts for each individual in the temporal network"""
         # see Eq.(2) in PechlivanogLou et al. 2022
-        for id, inner_dict in self.contact_durations.items():
-            self.risk_2s[id] = sum(inner_dict.values())
-            self.sum_risk_2s += self.risk_2s[id]
+        self.risk_2s = self.contact_durations.sum(axis=1)
+        self.sum_risk_2s = self.risk_2s.sum()
+        return
+
+    def calculate_risk_3(self, infect_rate: float):
+        """The probability of getting infected by any of its contacts factoring the total duration of these contacts"""
+        # see Eq.(3) in PechlivanogLou et al. 2022
+        # 1-(1-infect_rate)**duration of each contact, summed over the contacts of each individual
+        infect_probabilities = self.contact_durations.copy()
+        infect_probabilities.data = -np.expm1(
+            infect_probabilities.data*np.log1p(-min(infect_rate, 1-np.finfo(np.float64).eps)))
+        self.risk_3s = infect_probabilities.sum(axis=1)
+        self.sum_risk_3s = self.risk_3s.sum()
         return
 
-    # def calculate_risk_3(self):
-    #     """The probability of getting infected by any of its contacts factoring the total duration of these contacts"""
-    #     # see Eq.(3) in PechlivanogLou et al. 2022
-    #     for id, inner_dict in self.contact_durations.items():
-    #         # Is it the correct way to get beta
-    #         self.risk_3s[id] = sum((1-(1-self.calculate_infect_probability(duration, duration))**duration) for duration in inner_dict.values())
-    #         self.sum_risk_3s += self.risk_3s[id]
+    def get_risks_1(self) -> np.ndarray:
+        """risk_1 of all self.ids"""
+        return self.risk_1s
+
+    def get_risks_2(self) -> np.ndarray:
+        return self.risk_2s
+
+    def get_risks_3(self) -> np.ndarray:
+        return self.risk_3s
+
+    def get_relative_risks_1(self) -> np.ndarray:
+        return self.get_relative_risks(self.risk_1s, self.sum_risk_1s)
+
+    def get_relative_risks_2(self) -> np.ndarray:
+        return self.get_relative_risks(self.risk_2s, self.sum_risk_2s)
+
+    def get_relative_risks_3(self) -> np.ndarray:
+        return self.get_relative_risks(self.risk_3s, self.sum_risk_3s)
+
+    def get_relative_risks(self, risks: np.ndarray, sum_risks: float) -> np.ndarray:
+        return np.zeros(len(risks)) if sum_risks == 0 else risks/sum_risks
+
+    def get_risk(self, risks: np.ndarray, id) -> float:
+        """The risk of id in risks (aligned with self.ids), 0 for unknown ids"""
+        index = np.searchsorted(self.ids, id)
+        if index < len(risks) and self.ids[index] == id:
+            return risks[index].item()
+        return 0
 
     def get_risk_1(self, id) -> float:
-        return self.risk_1s.get(id, 0)
+        return self.get_risk(self.risk_1s, id)
 
     def get_risk_2(self, id) -> float:
-        return self.risk_2s.get(id, 0)
+        return self.get_risk(self.risk_2s, id)
 
     def get_risk_3(self, id) -> float:
-        return self.risk_3s.get(id, 0)
+        return self.get_risk(self.risk_3s, id)
 
     def get_relative_risk_1(self, id) -> float:
-        return 0 if self.sum_risk_1s == 0 else self.risk_1s.get(id, 0)/self.sum_risk_1s
+        return 0 if self.sum_risk_1s == 0 else self.get_risk_1(id)/self.sum_risk_1s
 
     def get_relative_risk_2(self, id) -> float:
-        return 0 if self.sum_risk_2s == 0 else self.risk_2s.get(id, 0)/self.sum_risk_2s
+        return 0 if self.sum_risk_2s == 0 else self.get_risk_2(id)/self.sum_risk_2s
 
     def get_relative_risk_3(self, id) -> float:
-        return 0 if self.sum_risk_3s == 0 else self.risk_3s.get(id, 0)/self.sum_risk_3s
+        return 0 if self.sum_risk_3s == 0 else self.get_risk_3(id)/self.sum_risk_3s
+
+    def build_network(self):
+        """Build the edges of all timesteps, or load them from the cache"""
+        self.instrumentation.run(
+            self.instrumentation_prefix + ".build", self.build_phases)
+        return
+
+    def build_phases(self):
+        name = self.instrumentation_prefix
+        arrays = None
+        if self.cache is not None:
+            with self.instrumentation.phase(name + ".cache_load"):
+                key = self.cache.get_key(name, self.list_of_dfs, ["id_1", "id_2", "contact_duration"],
+                                         [] if self.tags is None else [self.tags])
+                arrays = self.cache.load(key)
+            self.instrumentation.count(
+                name + ".cache_hits", int(arrays is not None))
+        if arrays is None:
+            with self.instrumentation.phase(name + ".compile"):
+                arrays = self.compile_network()
+            if self.cache is not None:
+                with self.instrumentation.phase(name + ".cache_store"):
+                    self.cache.store(key, arrays)
+        with self.instrumentation.phase(name + ".load"):
+            self.load_network(arrays)
+        with self.instrumentation.phase(name + ".risks"):
+            # contact_durations comes with the arrays
+            self.calculate_risk_1()
+            self.calculate_risk_2()
+
+        if self.use_networkx:
+            with self.instrumentation.phase(name + ".networkx"):
+                self.unique_graphs = [nx.freeze(self.to_graph(nodes, edges)) for nodes, edges in tqdm(
+                    zip(self.unique_nodes, self.unique_edges), total=len(self.unique_edges), desc="Building Trajectory Network")]
+                self.graphs = self.expand(self.unique_graphs)
+
+        if self.instrumentation.enabled:
+            self.instrumentation.count_all(name, contacts=sum(len(df) for df in self.list_of_dfs),
+                                           timesteps=self.get_no_timesteps(), unique_timesteps=len(self.unique_edges),
+                                           edges=sum(len(edges[0]) for edges in self.unique_edges))
+            self.instrumentation.set(name + ".array_bytes", sum(
+                array.nbytes for array in arrays.values()))
+        return
+
+    def compile_network(self) -> Dict[str, np.ndarray]:
+        """The edges of all timesteps from one pass over the concatenated dfs, as flat arrays.
+
+        Timesteps with the same individuals and contact durations are stored once, graph_index gives the distinct
+        timestep of each timestep and *_offsets the bounds of each distinct timestep in nodes and id_1, id_2, weights.
+        duration_* are the CSR arrays of contact_durations, so a cache hit does not aggregate the dfs again"""
+        days, id_1, id_2, weights = self.aggregate_contacts(self.list_of_dfs)
+        node_days, node_ids = self.get_nodes(self.list_of_dfs)
+
+        edge_bounds = np.searchsorted(days, np.arange(len(self.list_of_dfs)+1))
+        node_bounds = np.searchsorted(
+            node_days, np.arange(len(self.list_of_dfs)+1))
+
+        keys = {}
+        unique_days, graph_index = [], []
+        for day in range(len(self.list_of_dfs)):
+            nodes = node_ids[node_bounds[day]:node_bounds[day+1]]
+            edges = (id_1[edge_bounds[day]:edge_bounds[day+1]], id_2[edge_bounds[day]:edge_bounds[day+1]],
+                     weights[edge_bounds[day]:edge_bounds[day+1]])
+            key = self.hash_timestep(nodes, edges)
+            if key not in keys:
+                keys[key] = len(unique_days)
+                unique_days.append(day)
+            graph_index.append(keys[key])
+
+        unique_days = np.array(unique_days, dtype=np.int64)
+        node_counts = np.diff(node_bounds)[unique_days]
+        edge_counts = np.diff(edge_bounds)[unique_days]
+        unique_node_rows = np.concatenate([np.arange(node_bounds[day], node_bounds[day+1]) for day in unique_days]
+                                          ) if len(unique_days) > 0 else np.array([], dtype=np.int64)
+        unique_edge_rows = np.concatenate([np.arange(edge_bounds[day], edge_bounds[day+1]) for day in unique_days]
+                                          ) if len(unique_days) > 0 else np.array([], dtype=np.int64)
+
+        arrays = {"ids": np.unique(node_ids),
+                  "nodes": node_ids[unique_node_rows],
+                  "node_offsets": np.concatenate([[0], np.cumsum(node_counts)]).astype(np.int64),
+                  "id_1": id_1[unique_edge_rows],
+                  "id_2": id_2[unique_edge_rows],
+                  "edge_offsets": np.concatenate([[0], np.cumsum(edge_counts)]).astype(np.int64),
+                  "graph_index": np.array(graph_index, dtype=np.int64)}
+
+        contact_durations = self.get_contact_durations(arrays["ids"])
+        arrays["duration_data"] = contact_durations.data
+        arrays["duration_indices"] = contact_durations.indices
+        arrays["duration_indptr"] = contact_durations.indptr
+
+        day_durations = [weights[edge_bounds[day]:edge_bounds[day+1]]
+                         for day in unique_days]
+        if self.uniform_weights:
+            # one weight per distinct timestep instead of one per edge
+            arrays["day_weights"] = np.array([self.get_day_weight(
+                durations) for durations in day_durations], dtype=np.float64)
+        else:
+            arrays["weights"] = np.concatenate([self.get_edge_weights(durations) for durations in day_durations]
+                                               ) if len(unique_days) > 0 else np.array([], dtype=np.float64)
+        return arrays
+
+    def load_network(self, arrays: Dict[str, np.ndarray]):
+        """Set the nodes and edges of each timestep from the arrays of compile_network, without copying them"""
+        for array in arrays.values():
+            # identical timesteps share these arrays
+            array.flags.writeable = False
+
+        node_offsets = arrays["node_offsets"].tolist()
+        edge_offsets = arrays["edge_offsets"].tolist()
+        self.ids = arrays["ids"]
+        self.unique_nodes = [arrays["nodes"][start:end]
+                             for start, end in zip(node_offsets[:-1], node_offsets[1:])]
+        if self.uniform_weights:
+            # the weights of a timestep are a read-only view of its single weight
+            unique_weights = [np.broadcast_to(day_weight, end-start) for day_weight, start, end in zip(
+                arrays["day_weights"].tolist(), edge_offsets[:-1], edge_offsets[1:])]
+        else:
+            unique_weights = [arrays["weights"][start:end]
+                              for start, end in zip(edge_offsets[:-1], edge_offsets[1:])]
+        self.unique_edges = [(arrays["id_1"][start:end], arrays["id_2"][start:end], weights)
+                             for start, end, weights in zip(edge_offsets[:-1], edge_offsets[1:], unique_weights)]
+        self.graph_index = arrays["graph_index"].tolist()
+        if self.uniform_weights:
+            self.day_weights = arrays["day_weights"][self.graph_index]
+
+        self.nodes = self.expand(self.unique_nodes)
+        self.edges = self.expand(self.unique_edges)
+        self.contact_durations = sparse.csr_array((arrays["duration_data"], arrays["duration_indices"], arrays["duration_indptr"]),
+                                                  shape=(len(self.ids), len(self.ids)))
+
+    def hash_timestep(self, nodes: np.ndarray, edges) -> bytes:
+        """Digest of the individuals and (id_1, id_2, contact_duration) edges of a timestep.
+
+        Edges are sorted by (id_1, id_2) and hold durations only, so copies of a day shifted in time get the same digest"""
+        digest = hashlib.blake2b(digest_size=16)
+        for array in (nodes, *edges):
+            array = np.ascontiguousarray(array)
+            digest.update(array.dtype.str.encode())
+            digest.update(len(array).to_bytes(8, 'little'))
+            digest.update(array.tobytes())
+        return digest.digest()
+
+    def expand(self, unique: list) -> list:
+        """Per timestep list of references to the distinct timestep objects"""
+        return [unique[index] for index in self.graph_index]
+
+    @classmethod
+    def from_contacts(cls, df: pd.DataFrame, time_step: float, origin: float = 0, **kwargs):
+        """The network of the contact table df with one timestep every time_step seconds from origin, see bin_contacts"""
+        return cls(cls.bin_contacts(df, time_step, origin), **kwargs)
+
+    @staticmethod
+    def bin_contacts(df: pd.DataFrame, time_step: float, origin: float = 0) -> List[pd.DataFrame]:
+        """Split the contacts of df (columns "id_1", "id_2", "start_moment", "end_moment") into windows of time_step.
+
+        A contact crossing a window boundary is split, each part keeps the duration spent in its window as
+        "contact_duration". Windows start at origin, the parts of contacts before origin are dropped. The dfs of
+        all windows until the last contact are returned, including empty ones."""
+        start = df["start_moment"].to_numpy(dtype=np.float64) - origin
+        end = df["end_moment"].to_numpy(dtype=np.float64) - origin
+        kept = end > 0
+        start, end = np.maximum(start[kept], 0), end[kept]
+
+        # windows overlapped by each contact, a contact without duration belongs to the window of its start
+        first_window = np.floor(start/time_step).astype(np.int64)
+        last_window = np.maximum(
+            np.ceil(end/time_step).astype(np.int64)-1, first_window)
+        no_windows = last_window - first_window + 1
+
+        # one row per (contact, window)
+        rows = np.repeat(np.flatnonzero(kept), no_windows)
+        window = np.repeat(first_window, no_windows) + np.arange(no_windows.sum()) - \
+            np.repeat(np.cumsum(no_windows)-no_windows, no_windows)
+        part_start = np.maximum(np.repeat(start, no_windows), window*time_step)
+        part_end = np.minimum(np.repeat(end, no_windows), (window+1)*time_step)
+
+        parts = pd.DataFrame({"id_1": df["id_1"].to_numpy()[rows], "id_2": df["id_2"].to_numpy()[rows],
+                              "start_moment": part_start + origin, "end_moment": part_end + origin,
+                              "contact_duration": part_end - part_start})
+        order = np.argsort(window, kind='stable')
+        parts, window = parts.iloc[order].reset_index(drop=True), window[order]
+
+        no_timesteps = window[-1]+1 if len(window) > 0 else 0
+        bounds = np.searchsorted(window, np.arange(no_timesteps+1))
+        return [parts.iloc[bounds[index]:bounds[index+1]] for index in range(no_timesteps)]
+
+    def build_graph(self, df: pd.DataFrame) -> nx.Graph:
+        _, id_1, id_2, weights = self.aggregate_contacts([df])
+        _, nodes = self.get_nodes([df])
+        return self.to_graph(nodes, (id_1, id_2, self.get_edge_weights(weights)))
+
+    def get_edge_weights(self, contact_durations: np.ndarray) -> np.ndarray:
+        """The weight of each edge of a timestep given the total contact duration of its 2 individuals"""
+        if self.uniform_weights:
+            return np.broadcast_to(self.get_day_weight(contact_durations), len(contact_durations))
+        return contact_durations
+
+    def get_day_weight(self, contact_durations: np.ndarray) -> float:
+        """The weight of all edges of a timestep when uniform_weights"""
+        # The link between 2 individuals in the graph is the mean contact duration in the whole df
+        # see Stehlé et al. BMC Medicine 2011
+        return float(contact_durations.mean()) if len(contact_durations) > 0 else 0.0
+
+    def aggregate_contacts(self, list_of_dfs: List[pd.DataFrame]):
+        """day index, id_1 < id_2 and total contact duration of each pair of individuals in each df, sorted by day"""
+        frame = self.concat_dfs(list_of_dfs)
+        # the link between 2 individuals does not depend on the order of id_1 and id_2
+        id_1 = np.minimum(frame["id_1"].to_numpy(), frame["id_2"].to_numpy())
+        id_2 = np.maximum(frame["id_1"].to_numpy(), frame["id_2"].to_numpy())
+        pairs = pd.DataFrame({"day": frame["day"].to_numpy(), "id_1": id_1, "id_2": id_2,
+                              "contact_duration": frame["contact_duration"].to_numpy()})[id_1 != id_2]
+
+        edges = pairs.groupby(["day", "id_1", "id_2"], sort=True)[
+            "contact_duration"].sum().reset_index()
+        return edges["day"].to_numpy(), self.decode(edges["id_1"].to_numpy()), self.decode(edges["id_2"].to_numpy()), edges["contact_duration"].to_numpy()
+
+    def get_nodes(self, list_of_dfs: List[pd.DataFrame]):
+        """day index and id of the individuals appearing in each df, sorted by day and id"""
+        frame = self.concat_dfs(list_of_dfs)
+        nodes = pd.DataFrame({"day": np.concatenate([frame["day"].to_numpy()]*2),
+                              "id": np.concatenate([frame["id_1"].to_numpy(), frame["id_2"].to_numpy()])})
+        nodes = nodes.drop_duplicates().sort_values(["day", "id"])
+        return nodes["day"].to_numpy(), self.decode(nodes["id"].to_numpy())
+
+    def decode(self, ids: np.ndarray) -> np.ndarray:
+        """The individuals of ids, which are codes when tags is given"""
+        # codes are decoded after the aggregation, on the edges and nodes instead of every contact
+        return ids if self.tags is None else self.tags[ids]
+
+    def concat_dfs(self, list_of_dfs: List[pd.DataFrame]) -> pd.DataFrame:
+        """All dfs in one frame with a "day" column holding the index of their df"""
+        columns = ["id_1", "id_2", "contact_duration"]
+        if len(list_of_dfs) == 0:
+            return pd.DataFrame(columns=["day"] + columns, dtype=np.int64)
+        frame = pd.concat([df[columns] for df in list_of_dfs], ignore_index=True)
+        frame["day"] = np.repeat(np.arange(len(list_of_dfs)), [
+                                 len(df) for df in list_of_dfs])
+        return frame
+
+    def to_graph(self, nodes: np.ndarray, edges) -> nx.Graph:
+        id_1, id_2, weights = edges
+        G = nx.Graph()
+        G.add_nodes_from(nodes.tolist())
+        if self.uniform_weights:
+            # the edges share the weight of the graph instead of holding a copy each
+            G.graph["weight"] = float(weights[0]) if len(weights) > 0 else 0.0
+            G.add_edges_from(zip(id_1.tolist(), id_2.tolist()))
+        else:
+            G.add_weighted_edges_from(
+                zip(id_1.tolist(), id_2.tolist(), weights.tolist()))
+        return G
+
+    def get_no_timesteps(self) -> int:
+        return len(self.graph_index)
 
     def get_trajectory_network(self) -> List[nx.Graph]:
-        return self.graphs
+        """The nx.Graph of each timestep, or their sparse matrices over self.ids without networkx"""
+        if self.use_networkx:
+            return self.graphs
+        return self.get_sparse_trajectory_network(self.ids)
+
+    def get_sparse_trajectory_network(self, ids: np.ndarray) -> List[sparse.csr_array]:
+        """The graphs as symmetric CSR matrices of edge weights, row/column i is ids[i] (ids must be sorted)"""
+        key = (ids.dtype.str, ids.tobytes())
+        if key not in self.sparse_graphs:
+            self.sparse_graphs[key] = self.expand([self.edges_to_sparse(
+                edges, ids) for edges in self.unique_edges])
+        return self.sparse_graphs[key]
+
+    def get_adjacency_trajectory_network(self, ids: np.ndarray) -> List[sparse.csr_array]:
+        """The graphs as symmetric unweighted CSR matrices (int8 ones), row/column i is ids[i] (ids must be sorted)"""
+        key = ("adjacency", ids.dtype.str, ids.tobytes())
+        if key not in self.sparse_graphs:
+            self.sparse_graphs[key] = self.expand([self.edges_to_sparse(
+                (id_1, id_2, np.ones(len(id_1), dtype=np.int8)), ids) for id_1, id_2, _ in self.unique_edges])
+        return self.sparse_graphs[key]
+
+    def get_log_escape_kernels(self, ids: np.ndarray, infect_rate: float) -> list:
+        """(graph, edge_log_escape) of each timestep.
+
+        With uniform_weights, graph is the unweighted adjacency matrix and edge_log_escape the log escape probability
+        shared by all its edges, so a person's log escape is edge_log_escape times its number of infectious neighbors.
+        Otherwise graph holds the log escape probability of each edge and edge_log_escape is None."""
+        if not self.uniform_weights:
+            return [(graph, None) for graph in self.get_log_escape_trajectory_network(ids, infect_rate)]
+
+        log_escapes = self.calculate_log_escape_probability(
+            infect_rate*self.day_weights).tolist()
+        return list(zip(self.get_adjacency_trajectory_network(ids), log_escapes))
+
+    def get_log_escape_trajectory_network(self, ids: np.ndarray, infect_rate: float) -> List[sparse.csr_array]:
+        """The sparse graphs with the log of the probability of not being infected through each edge in a timestep.
+
+        The infect probability of an edge is infect_rate*weight (see Stehlé et al. BMC Medicine 2011), it is computed once
+        per graph and infect_rate and shared by all the simulations on this network."""
+        key = (ids.dtype.str, ids.tobytes(), infect_rate)
+        if key not in self.log_escape_graphs:
+            # identical timesteps share one sparse graph, so each distinct graph is computed once
+            log_escape = {}
+            for graph in self.get_sparse_trajectory_network(ids):
+                if id(graph) not in log_escape:
+                    log_escape[id(graph)] = self.calculate_log_escape(
+                        graph, infect_rate)
+            self.log_escape_graphs[key] = [log_escape[id(graph)]
+                                           for graph in self.get_sparse_trajectory_network(ids)]
+        return self.log_escape_graphs[key]
+
+    def calculate_log_escape(self, graph: sparse.csr_array, infect_rate: float) -> sparse.csr_array:
+        log_escape = graph.copy()
+        log_escape.data = self.calculate_log_escape_probability(
+            infect_rate*graph.data)
+        return log_escape
+
+    def calculate_log_escape_probability(self, infect_probability: np.ndarray) -> np.ndarray:
+        escape_probability = 1 - np.minimum(infect_probability, 1)
+        # a certain infection gives the smallest log instead of -inf to keep the sparse products finite
+        return np.log(np.maximum(escape_probability, np.finfo(np.float64).tiny))
+
+    def edges_to_sparse(self, edges, ids: np.ndarray) -> sparse.csr_array:
+        id_1, id_2, weights = edges
+        # adjacency matrices stay int8, other weights are float64
+        weights = np.asarray(weights)
+        if weights.dtype != np.int8:
+            weights = weights.astype(np.float64)
+        if len(id_1) == 0 or len(ids) == 0:
+            return sparse.csr_array((len(ids), len(ids)), dtype=weights.dtype)
+
+        # nodes which are not in ids are left out
+        index_1 = np.minimum(np.searchsorted(ids, id_1), len(ids)-1)
+        index_2 = np.minimum(np.searchsorted(ids, id_2), len(ids)-1)
+        known = (ids[index_1] == id_1) & (ids[index_2] == id_2)
+        index_1, index_2, weights = index_1[known], index_2[known], weights[known]
+
+        return sparse.csr_array((np.concatenate([weights, weights]), (np.concatenate([index_1, index_2]), np.concatenate([index_2, index_1]))), shape=(len(ids), len(ids)))